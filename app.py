@@ -1,25 +1,47 @@
+import base64
+import hmac
+import math
 import os
+import time
+from contextlib import ExitStack, closing
 from datetime import datetime, timezone
 from flask import (Flask, render_template, redirect, url_for, flash,
-                   request, abort, send_from_directory, jsonify)
+                   request, abort, jsonify, Response, send_file, stream_with_context)
 from flask_login import (LoginManager, login_user, logout_user,
                          login_required, current_user)
 from werkzeug.utils import secure_filename
 
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+import click
 
 from config import Config
-from models import db, User, Submission, Comment, Like
+from models import db, User, Submission, SubmissionRank, Comment, Like, UserUsage
 from forms import RegistrationForm, LoginForm, UploadForm, CommentForm
-from utils import filter_sensitive_words, upload_to_taiko_server, ensure_upload_dir
+from utils import filter_sensitive_words, format_duration, post_chart, read_chart
+from storage import make_storage, migrate_legacy
+import sweeper
+import ranking
+import delivery
+from export import Exporter, FORMATS as EXPORT_FORMATS, export_slot, parse_since
+from oggprobe import OggError, OggProbe, ProbingReader, probe_file
+from retry_policy import RetryPolicy, breaker_states
+from bootstrap import bootstrap, bootstrap_lock, ensure_admin, init_db
+import metrics
+import profiling
+import jsonlog
 
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(Config)
 
     # Ensure upload folder exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    storage = make_storage(app.config)
+    app.extensions['storage'] = storage
 
     # Init extensions
     db.init_app(app)
@@ -35,22 +57,191 @@ def create_app():
     def load_user(user_id):
         return db.session.get(User, int(user_id))
 
+    jsonlog.init_app(app)
+    upload_policy = RetryPolicy.from_config(app.config)
+
+    def deliver(sub, urls):
+        """
+        Upload `sub` to every server in `urls` concurrently and record a
+        Delivery per server. Returns {url: (ok, message)}; raises
+        FileNotFoundError if the submission's files are gone.
+        """
+        def log_retry(attempt, delay, error):
+            metrics.REMOTE_UPLOAD_RETRIES.inc()
+            app.logger.warning(f'Upload of submission {sub.id} failed '
+                               f'(attempt {attempt}: {error}), retrying in {delay:.1f}s',
+                               extra={'submission_id': sub.id, 'attempt': attempt})
+
+        with storage.local_path(sub.id, sub.tja_filename) as tja_path, \
+                storage.local_path(sub.id, sub.ogg_filename) as ogg_path:
+            files = read_chart(tja_path, ogg_path)
+        sent_bytes = sum(len(f[1]) for f in files.values())
+        song_type = sub.song_type
+
+        def send(url):
+            started = time.perf_counter()
+            ok, msg = post_chart(files, song_type, url, app.config['USE_PROXY'],
+                                 app.config.get('PROXY_URL'), policy=upload_policy,
+                                 on_retry=log_retry)
+            metrics.REMOTE_UPLOAD_DURATION.observe(time.perf_counter() - started)
+            metrics.REMOTE_UPLOADS.inc(result='success' if ok else 'failure')
+            if ok:
+                metrics.REMOTE_UPLOAD_BYTES.inc(sent_bytes)
+            return ok, msg
+
+        results = delivery.fan_out(send, urls)
+        delivery.record(sub, results)
+        return results
+    metrics.init_app(app)
+    metrics.registry.gauge(
+        'taiko_pending_submissions', 'Submissions waiting for review.',
+        lambda: Submission.query.filter_by(status=Submission.STATUS_PENDING).count())
+    metrics.registry.gauge(
+        'taiko_storage_bytes', 'Bytes of submission files currently stored.',
+        lambda: db.session.query(db.func.sum(UserUsage.bytes_used)).scalar() or 0)
+    profiler = profiling.init_app(
+        app, lambda: current_user.is_authenticated and current_user.is_admin)
+
     # ── Create tables & default admin ────────────────────────────────────
-    with app.app_context():
-        db.create_all()
-        admin_user = os.environ.get('ADMIN_USERNAME', 'admin')
-        admin_pass = os.environ.get('ADMIN_PASSWORD', 'admin123')
-        if not User.query.filter_by(is_admin=True).first():
-            admin = User(username=admin_user, email='admin@taiko.local', is_admin=True)
-            admin.set_password(admin_pass)
-            db.session.add(admin)
+    if app.config['AUTO_INIT_DB']:
+        bootstrap(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables (run once per deploy, before the workers)."""
+        with bootstrap_lock(app.config['SQLALCHEMY_DATABASE_URI']):
+            init_db()
+        click.echo('数据库已初始化')
+
+    @app.cli.command('create-admin')
+    @click.option('--username', default=lambda: os.environ.get('ADMIN_USERNAME', 'admin'),
+                  show_default='$ADMIN_USERNAME 或 admin')
+    @click.option('--password', default=lambda: os.environ.get('ADMIN_PASSWORD'),
+                  help='默认读取 $ADMIN_PASSWORD，未设置时提示输入')
+    @click.option('--email', default='admin@taiko.local', show_default=True)
+    def create_admin_command(username, password, email):
+        """Create or promote an admin account and set its password."""
+        if not password:
+            password = click.prompt('管理员密码', hide_input=True, confirmation_prompt=True)
+        with bootstrap_lock(app.config['SQLALCHEMY_DATABASE_URI']):
+            user = ensure_admin(username, password, email, reset=True)
+        if user is None:
+            raise click.ClickException(f'无法创建管理员 {username}（用户名或邮箱冲突）')
+        click.echo(f'管理员 {user.username} 已就绪')
+
+    @app.cli.command('migrate-storage')
+    @click.option('--keep', is_flag=True, help='复制到 S3 后保留本地文件')
+    def migrate_storage_command(keep):
+        """Move uploads/<id>/ directories into the configured storage backend."""
+        moved, nbytes = migrate_legacy(app.config['UPLOAD_FOLDER'], storage,
+                                       delete=not keep, log=click.echo)
+        click.echo(f'迁移完成：{moved} 个投稿，{nbytes / 1024 / 1024:.1f} MB')
+
+    @app.cli.command('sweep')
+    @click.option('--dry-run', is_flag=True, help='只统计，不删除')
+    @click.option('--days', type=int, default=None, help='保留天数（默认 SWEEP_RETENTION_DAYS）')
+    def sweep_command(dry_run, days):
+        """Delete files of long-closed submissions and orphaned files."""
+        if days is None:
+            days = app.config['SWEEP_RETENTION_DAYS']
+        stats = sweeper.sweep(storage, days, app.config['SWEEP_ORPHAN_GRACE_HOURS'],
+                              dry_run=dry_run, log=click.echo)
+        prefix = '[预演] ' if dry_run else ''
+        click.echo(f'{prefix}清理投稿 {stats["purged"]} 个（{stats["purged_bytes"] / 1024 / 1024:.1f} MB），'
+                   f'孤立文件 {stats["orphans"]} 组（{stats["orphan_bytes"] / 1024 / 1024:.1f} MB）')
+
+    @app.cli.command('rank-decay')
+    def rank_decay_command():
+        """Recompute hot scores for the current time (run every few minutes)."""
+        ranking.decay(log=click.echo)
+
+    @app.cli.command('rank-rebuild')
+    def rank_rebuild_command():
+        """Recount likes/comments of every approved submission from scratch."""
+        ranking.rebuild(log=click.echo)
+
+    @app.cli.command('export')
+    @click.argument('output', type=click.File('wb'))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='zip')
+    @click.option('--since', default=None, help='只导出该时间之后通过的投稿（ISO 8601 或 Unix 时间）')
+    def export_command(output, fmt, since):
+        """Write an archive of approved submissions to OUTPUT ('-' for stdout)."""
+        try:
+            since = parse_since(since)
+        except ValueError:
+            raise click.BadParameter('无法解析的时间', param_hint='--since')
+        exporter = Exporter(storage, since)
+        for chunk in exporter.stream(fmt):
+            output.write(chunk)
+        click.echo(f'已导出 {len(exporter.songs)} 首，下次增量导出使用 --since {exporter.manifest()["until"]}',
+                   err=True)
+
+    @app.cli.command('redeliver')
+    @click.option('--sid', type=int, default=None, help='只重试该投稿')
+    def redeliver_command(sid):
+        """Upload approved submissions to every configured server that lacks them."""
+        urls = delivery.targets(app.config)
+        retried = still_failing = 0
+        for sub in delivery.incomplete(urls, sid):
+            try:
+                results = deliver(sub, delivery.undelivered(sub, urls))
+            except FileNotFoundError:
+                click.echo(f'#{sub.id} 文件丢失，跳过')
+                continue
+            db.session.commit()
+            for url, (ok, msg) in results.items():
+                retried += 1
+                if not ok:
+                    still_failing += 1
+                    click.echo(f'#{sub.id} -> {delivery.host_of(url)}: {msg}')
+        click.echo(f'已重试 {retried} 次上传，{retried - still_failing} 次成功')
+
+    @app.cli.command('probe-audio')
+    @click.option('--all', 'probe_all', is_flag=True, help='重新检查所有投稿，而不只是缺少音频信息的')
+    def probe_audio_command(probe_all):
+        """Fill in duration/sample rate/bitrate of submissions stored before probing."""
+        q = Submission.query.filter(Submission.purged_at.is_(None), Submission.ogg_filename != '')
+        if not probe_all:
+            q = q.filter(Submission.audio_duration.is_(None))
+        probed = invalid = last = 0
+        while True:
+            batch = q.filter(Submission.id > last).order_by(Submission.id).limit(100).all()
+            if not batch:
+                break
+            for sub in batch:
+                try:
+                    with closing(storage.open(sub.id, sub.ogg_filename)) as f:
+                        set_audio_info(sub, probe_file(f))
+                    probed += 1
+                except OggError as e:
+                    invalid += 1
+                    click.echo(f'#{sub.id} {sub.title}: {e}')
+                except FileNotFoundError:
+                    continue
+            last = batch[-1].id
             db.session.commit()
+        click.echo(f'已检查 {probed + invalid} 个音频，{invalid} 个无效')
+
+    @app.cli.command('usage-recount')
+    def usage_recount_command():
+        """Rebuild per-user storage usage from the submissions table."""
+        users = sweeper.recount(storage, log=click.echo)
+        click.echo(f'已重建 {users} 个用户的存储用量')
 
     # ── Context processor ────────────────────────────────────────────────
     @app.context_processor
     def inject_now():
         return {'now': datetime.now(timezone.utc)}
 
+    app.add_template_filter(delivery.host_of, 'host')
+    app.add_template_filter(format_duration, 'duration')
+
+    def set_audio_info(sub, audio):
+        sub.audio_duration = round(audio.duration, 3)
+        sub.audio_sample_rate = audio.sample_rate
+        sub.audio_channels = audio.channels
+        sub.audio_bitrate = audio.bitrate
+
     # ── Routes ───────────────────────────────────────────────────────────
 
     @app.route('/')
@@ -104,7 +295,15 @@ def create_app():
     @login_required
     def upload():
         form = UploadForm()
+        quota = app.config['USER_QUOTA_BYTES']
         if form.validate_on_submit():
+            started = time.perf_counter()
+            over_quota = f'存储空间不足（配额 {quota // 1024 // 1024} MB），请等待已取消/未通过的投稿被清理。'
+            # Cheap early reject; the authoritative check is sweeper.charge() below.
+            if quota and sweeper.bytes_used(current_user.id) + (request.content_length or 0) > quota:
+                flash(over_quota, 'danger')
+                return render_template('upload.html', form=form)
+            sid = None
             try:
                 # Create submission record first to get ID
                 submission = Submission(
@@ -117,9 +316,7 @@ def create_app():
                 )
                 db.session.add(submission)
                 db.session.flush()  # Get ID
-
-                # Save files in per-submission directory
-                upload_dir = ensure_upload_dir(app.config['UPLOAD_FOLDER'], submission.id)
+                sid = submission.id
 
                 tja = form.tja_file.data
                 ogg = form.ogg_file.data
@@ -131,18 +328,42 @@ def create_app():
                 if not ogg_name or not ogg_name.lower().endswith('.ogg'):
                     ogg_name = f'{submission.id}.ogg'
 
-                tja.save(os.path.join(upload_dir, tja_name))
-                ogg.save(os.path.join(upload_dir, ogg_name))
+                tja_bytes = storage.save(submission.id, tja_name, tja.stream)
+                # Validated page by page as it is written; raises OggError.
+                probe = OggProbe()
+                ogg_bytes = storage.save(submission.id, ogg_name, ProbingReader(ogg.stream, probe))
+                audio = probe.finish()
 
                 submission.tja_filename = tja_name
                 submission.ogg_filename = ogg_name
+                submission.storage_bytes = tja_bytes + ogg_bytes
+                set_audio_info(submission, audio)
+                if not sweeper.charge(current_user.id, submission.storage_bytes, quota):
+                    db.session.rollback()
+                    storage.delete(sid)
+                    flash(over_quota, 'danger')
+                    return render_template('upload.html', form=form)
                 db.session.commit()
 
+                metrics.UPLOAD_BYTES.inc(tja_bytes, kind='tja')
+                metrics.UPLOAD_BYTES.inc(ogg_bytes, kind='ogg')
+                metrics.UPLOAD_DURATION.observe(time.perf_counter() - started)
+
                 flash('投稿成功！等待管理员审核。', 'success')
                 return redirect(url_for('dashboard'))
+            except OggError as e:
+                db.session.rollback()
+                storage.delete(sid)
+                flash(f'OGG 文件无效：{e}', 'danger')
             except Exception as e:
                 db.session.rollback()
-                app.logger.error(f'Upload failed: {e}')
+                app.logger.error(f'Upload failed: {e}', exc_info=True,
+                                 extra={'submission_id': sid})
+                if sid is not None:
+                    try:
+                        storage.delete(sid)
+                    except Exception:
+                        pass  # left for `flask sweep`
                 flash('上传失败，请重试。', 'danger')
         return render_template('upload.html', form=form)
 
@@ -155,7 +376,9 @@ def create_app():
         submissions = Submission.query.filter_by(user_id=current_user.id) \
             .order_by(Submission.created_at.desc()) \
             .paginate(page=page, per_page=10, error_out=False)
-        return render_template('dashboard.html', submissions=submissions)
+        return render_template('dashboard.html', submissions=submissions,
+                               bytes_used=sweeper.bytes_used(current_user.id),
+                               quota=app.config['USER_QUOTA_BYTES'])
 
     @app.route('/cancel/<int:sid>', methods=['POST'])
     @login_required
@@ -169,22 +392,37 @@ def create_app():
             flash('只能取消审核中的投稿', 'warning')
             return redirect(url_for('dashboard'))
         sub.status = Submission.STATUS_CANCELLED
+        sub.closed_at = datetime.now(timezone.utc)
         db.session.commit()
         flash('投稿已取消', 'info')
         return redirect(url_for('dashboard'))
 
     # ── Community ────────────────────────────────────────────────────────
 
+    COMMUNITY_SORTS = {
+        'new': (SubmissionRank.approved_at.desc(), SubmissionRank.submission_id.desc()),
+        'hot': (SubmissionRank.hot_score.desc(), SubmissionRank.submission_id.desc()),
+        'likes': (SubmissionRank.like_count.desc(), SubmissionRank.submission_id.desc()),
+        'comments': (SubmissionRank.comment_count.desc(), SubmissionRank.submission_id.desc()),
+    }
+
     @app.route('/community')
     def community():
         page = request.args.get('page', 1, type=int)
-        submissions = Submission.query.filter_by(status=Submission.STATUS_APPROVED) \
-            .order_by(Submission.reviewed_at.desc()) \
+        sort = request.args.get('sort', 'new')
+        if sort not in COMMUNITY_SORTS:
+            sort = 'new'
+        # Every approved submission has a rank row; each sort is an index scan.
+        submissions = Submission.query.join(Submission.rank) \
+            .options(contains_eager(Submission.rank), joinedload(Submission.author)) \
+            .order_by(*COMMUNITY_SORTS[sort]) \
             .paginate(page=page, per_page=12, error_out=False)
-        return render_template('community.html', submissions=submissions)
+        return render_template('community.html', submissions=submissions, sort=sort)
 
-    @app.route('/submission/<int:sid>')
-    def submission_detail(sid):
+    COMMENTS_PER_PAGE = 20
+
+    def visible_submission(sid):
+        """Submission `sid`, or 404 unless approved or owned/admin-viewed."""
         sub = db.session.get(Submission, sid)
         if sub is None:
             abort(404)
@@ -194,8 +432,43 @@ def create_app():
                 abort(404)
             if not current_user.is_admin and sub.user_id != current_user.id:
                 abort(404)
+        return sub
+
+    def encode_cursor(comment):
+        raw = f'{comment.created_at.isoformat()}|{comment.id}'
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            ts, cid = raw.rsplit('|', 1)
+            return datetime.fromisoformat(ts), int(cid)
+        except (ValueError, UnicodeError):
+            abort(400)
+
+    def comment_page(sid, cursor=None, limit=COMMENTS_PER_PAGE):
+        """
+        Newest-first page of comments with authors joined, keyed on
+        (created_at, id) so deep pages cost the same as the first.
+        Returns (comments, next_cursor or None).
+        """
+        q = Comment.query.options(joinedload(Comment.author)) \
+            .filter(Comment.submission_id == sid)
+        if cursor:
+            ts, cid = decode_cursor(cursor)
+            q = q.filter(or_(Comment.created_at < ts,
+                             and_(Comment.created_at == ts, Comment.id < cid)))
+        rows = q.order_by(Comment.created_at.desc(), Comment.id.desc()) \
+            .limit(limit + 1).all()
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(rows[limit - 1])
+        return rows, None
+
+    @app.route('/submission/<int:sid>')
+    def submission_detail(sid):
+        sub = visible_submission(sid)
         form = CommentForm()
-        comments = sub.comments.order_by(Comment.created_at.desc()).all()
+        comments, next_cursor = comment_page(sid)
         user_liked = False
         if current_user.is_authenticated:
             user_liked = Like.query.filter_by(
@@ -203,7 +476,24 @@ def create_app():
             ).first() is not None
         return render_template('submission_detail.html',
                                submission=sub, form=form,
-                               comments=comments, user_liked=user_liked)
+                               comments=comments, next_cursor=next_cursor,
+                               user_liked=user_liked)
+
+    @app.route('/api/submissions/<int:sid>/comments')
+    def api_comments(sid):
+        visible_submission(sid)
+        limit = max(1, min(request.args.get('limit', COMMENTS_PER_PAGE, type=int), 100))
+        comments, next_cursor = comment_page(sid, request.args.get('cursor'), limit)
+        return jsonify({
+            'comments': [{
+                'id': c.id,
+                'content': c.content,
+                'created_at': c.created_at.isoformat(),
+                'author': {'id': c.author.id, 'username': c.author.username},
+            } for c in comments],
+            'html': ''.join(render_template('_comment.html', c=c) for c in comments),
+            'next_cursor': next_cursor,
+        })
 
     @app.route('/like/<int:sid>', methods=['POST'])
     @login_required
@@ -218,15 +508,17 @@ def create_app():
         ).first()
         if existing:
             db.session.delete(existing)
-            db.session.commit()
+            rank = ranking.bump(sid, likes=-1)
             liked = False
         else:
             like = Like(user_id=current_user.id, submission_id=sid)
             db.session.add(like)
-            db.session.commit()
+            rank = ranking.bump(sid, likes=1)
             liked = True
+        db.session.commit()
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return jsonify({'liked': liked, 'count': sub.like_count})
+            count = rank.like_count if rank is not None else sub.like_count
+            return jsonify({'liked': liked, 'count': count})
         return redirect(url_for('submission_detail', sid=sid))
 
     @app.route('/comment/<int:sid>', methods=['POST'])
@@ -246,8 +538,14 @@ def create_app():
                 content=filtered,
             )
             db.session.add(comment)
+            ranking.bump(sid, comments=1)
             db.session.commit()
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({'html': render_template('_comment.html', c=comment),
+                                'count': sub.comment_count}), 201
             flash('评论发表成功', 'success')
+        elif request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'errors': form.errors}), 400
         return redirect(url_for('submission_detail', sid=sid))
 
     # ── Admin ────────────────────────────────────────────────────────────
@@ -260,7 +558,8 @@ def create_app():
         tab = request.args.get('tab', 'pending')
         page = request.args.get('page', 1, type=int)
         if tab == 'approved':
-            q = Submission.query.filter_by(status=Submission.STATUS_APPROVED)
+            q = Submission.query.filter_by(status=Submission.STATUS_APPROVED) \
+                .options(selectinload(Submission.deliveries))
         elif tab == 'rejected':
             q = Submission.query.filter_by(status=Submission.STATUS_REJECTED)
         else:
@@ -268,7 +567,61 @@ def create_app():
             tab = 'pending'
         submissions = q.order_by(Submission.created_at.desc()) \
             .paginate(page=page, per_page=20, error_out=False)
-        return render_template('admin.html', submissions=submissions, tab=tab)
+        breakers = [b for b in breaker_states() if b['state'] != 'closed']
+        undelivered = {}
+        if tab == 'approved':
+            urls = delivery.targets(app.config)
+            undelivered = {sub.id: delivery.undelivered(sub, urls) for sub in submissions.items}
+        return render_template('admin.html', submissions=submissions, tab=tab,
+                               breakers=breakers, undelivered=undelivered)
+
+    @app.route('/1128admin1128/profiles')
+    @login_required
+    def admin_profiles():
+        if not current_user.is_admin:
+            abort(403)
+        if profiler is None:
+            abort(404)
+        return render_template('admin_profiles.html', rows=profiler.slowest_by_endpoint(),
+                               rate=profiler.current_rate(), header=profiling.HEADER)
+
+    @app.route('/1128admin1128/profiles/rate', methods=['POST'])
+    @login_required
+    def admin_profiles_rate():
+        if not current_user.is_admin:
+            abort(403)
+        if profiler is None:
+            abort(404)
+        try:
+            percent = float(request.form.get('percent', ''))
+        except ValueError:
+            percent = math.nan
+        if not math.isfinite(percent):
+            flash('采样比例必须是 0–100 之间的数字', 'danger')
+            return redirect(url_for('admin_profiles'))
+        rate = profiler.set_rate(percent / 100)
+        flash(f'采样比例已设为 {rate * 100:g}%（各进程 {profiling.SETTINGS_TTL:g} 秒内生效）', 'success')
+        return redirect(url_for('admin_profiles'))
+
+    @app.route('/1128admin1128/profiles/<name>')
+    @login_required
+    def admin_profile(name):
+        if not current_user.is_admin:
+            abort(403)
+        if profiler is None:
+            abort(404)
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'ncalls'):
+            sort = 'cumulative'
+        try:
+            if request.args.get('download'):
+                return send_file(profiler.path(name), mimetype='application/octet-stream',
+                                 as_attachment=True, download_name=name + '.prof')
+            meta = profiler.meta(name)
+            report = profiler.report(name, sort)
+        except FileNotFoundError:
+            abort(404)
+        return render_template('admin_profile.html', meta=meta, report=report, sort=sort)
 
     @app.route('/1128admin1128/review/<int:sid>', methods=['POST'])
     @login_required
@@ -294,41 +647,65 @@ def create_app():
         sub.reviewed_at = datetime.now(timezone.utc)
 
         if action == 'approve':
-            # Try uploading to taiko.asia
-            upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(sub.id))
-            tja_path = os.path.join(upload_dir, sub.tja_filename)
-            ogg_path = os.path.join(upload_dir, sub.ogg_filename)
-
-            if not os.path.isfile(tja_path) or not os.path.isfile(ogg_path):
+            urls = delivery.undelivered(sub, delivery.targets(app.config))
+            try:
+                results = deliver(sub, urls)
+            except FileNotFoundError:
                 flash('投稿文件丢失，无法上传', 'danger')
                 return redirect(url_for('admin_panel'))
-
-            ok, msg = upload_to_taiko_server(
-                tja_path, ogg_path, sub.song_type,
-                app.config['TAIKO_SERVER_URL'],
-                app.config['USE_PROXY'],
-                app.config.get('PROXY_URL'),
-            )
-            if ok:
-                sub.status = Submission.STATUS_APPROVED
-                flash(f'投稿 "{sub.title}" 已通过并上传到服务器', 'success')
-            else:
-                flash(f'上传到服务器失败: {msg}。投稿保持审核中状态。', 'danger')
+            errors = [f'{delivery.host_of(u)}: {msg}' for u, (ok, msg) in results.items() if not ok]
+            if results and len(errors) == len(results):
+                flash(f'上传到服务器失败: {"；".join(errors)}。投稿保持审核中状态。', 'danger')
                 return redirect(url_for('admin_panel'))
+            sub.status = Submission.STATUS_APPROVED
+            ranking.publish(sub)
+            if errors:
+                flash(f'投稿 "{sub.title}" 已通过，已上传到 {len(results) - len(errors)}/{len(results)} '
+                      f'个服务器；失败: {"；".join(errors)}。可在「已通过」中重试。', 'warning')
+            else:
+                flash(f'投稿 "{sub.title}" 已通过并上传到服务器', 'success')
         else:
             sub.status = Submission.STATUS_REJECTED
+            sub.closed_at = sub.reviewed_at
             flash(f'投稿 "{sub.title}" 已拒绝', 'info')
 
         db.session.commit()
         return redirect(url_for('admin_panel'))
 
+    @app.route('/1128admin1128/deliveries/<int:sid>/retry', methods=['POST'])
+    @login_required
+    def admin_retry_delivery(sid):
+        if not current_user.is_admin:
+            abort(403)
+        sub = db.session.get(Submission, sid)
+        if sub is None or sub.status != Submission.STATUS_APPROVED:
+            abort(404)
+        urls = delivery.undelivered(sub, delivery.targets(app.config))
+        if not urls:
+            flash('没有需要重试的服务器', 'info')
+            return redirect(url_for('admin_panel', tab='approved'))
+        try:
+            results = deliver(sub, urls)
+        except FileNotFoundError:
+            flash('投稿文件丢失，无法上传', 'danger')
+            return redirect(url_for('admin_panel', tab='approved'))
+        db.session.commit()
+        errors = [f'{delivery.host_of(u)}: {msg}' for u, (ok, msg) in results.items() if not ok]
+        if errors:
+            flash(f'投稿 "{sub.title}" 仍有 {len(errors)} 个服务器上传失败: {"；".join(errors)}', 'danger')
+        else:
+            flash(f'投稿 "{sub.title}" 已补发到 {len(results)} 个服务器', 'success')
+        return redirect(url_for('admin_panel', tab='approved'))
+
     @app.route('/1128admin1128/preview/<int:sid>/<path:filename>')
     @login_required
     def admin_preview_file(sid, filename):
         if not current_user.is_admin:
             abort(403)
-        upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(sid))
-        return send_from_directory(upload_dir, filename)
+        try:
+            return storage.send(sid, filename)
+        except FileNotFoundError:
+            abort(404)
 
     # ── Public download (approved submissions only) ────────────────────
 
@@ -345,15 +722,86 @@ def create_app():
             dl_name = f'{sub.title}.ogg'
         else:
             abort(404)
-        upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], str(sid))
-        if not os.path.isfile(os.path.join(upload_dir, filename)):
+        try:
+            return storage.send(sid, filename, as_attachment=True, download_name=dl_name)
+        except FileNotFoundError:
+            abort(404)
+
+    # ── Bulk export for mirrors ─────────────────────────────────────────
+
+    def export_request():
+        """Exporter for this request's ?since= / ?limit=; aborts on a bad token or value."""
+        token = app.config['EXPORT_TOKEN']
+        if token:
+            given = request.args.get('token') or \
+                request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8')) and \
+                    not (current_user.is_authenticated and current_user.is_admin):
+                abort(403)
+        try:
+            since = parse_since(request.args.get('since'))
+        except ValueError:
+            abort(400)
+        page_size = app.config['EXPORT_PAGE_SIZE']
+        limit = max(1, min(request.args.get('limit', page_size, type=int), page_size))
+        return Exporter(storage, since, limit=limit)
+
+    def export_busy():
+        resp = Response('导出繁忙，请稍后再试\n', status=503, mimetype='text/plain')
+        resp.headers['Retry-After'] = '30'
+        return resp
+
+    @app.route('/export/manifest.json')
+    def export_manifest():
+        exporter = export_request()
+        with export_slot(app.config['SQLALCHEMY_DATABASE_URI'], app.config['EXPORT_SLOTS']) as ok:
+            if not ok:
+                return export_busy()
+            for _ in exporter.entries():
+                pass
+        return jsonify(exporter.manifest())
+
+    @app.route('/export.<fmt>')
+    def export_archive(fmt):
+        if fmt not in EXPORT_FORMATS:
+            abort(404)
+        exporter = export_request()
+        # The slot is held until the archive is sent or the response is
+        # closed (client gone, or never iterated).
+        stack = ExitStack()
+        if not stack.enter_context(export_slot(app.config['SQLALCHEMY_DATABASE_URI'],
+                                               app.config['EXPORT_SLOTS'])):
+            stack.close()
+            return export_busy()
+        until = exporter.manifest()['until']
+
+        def chunks():
+            with stack:
+                for chunk in exporter.stream(fmt):
+                    if chunk:
+                        yield chunk
+
+        resp = Response(stream_with_context(chunks()), mimetype=EXPORT_FORMATS[fmt])
+        resp.call_on_close(stack.close)
+        stamp = until.replace(':', '').replace('-', '')[:15]
+        resp.headers['Content-Disposition'] = f'attachment; filename="taiko-export-{stamp}.{fmt}"'
+        resp.headers['X-Export-Until'] = until
+        resp.headers['X-Export-More'] = '1' if exporter.more else '0'
+        return resp
+
+    # ── Metrics (localhost or admin only) ───────────────────────────────
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if request.remote_addr not in ('127.0.0.1', '::1') and \
+                not (current_user.is_authenticated and current_user.is_admin):
             abort(404)
-        return send_from_directory(
-            upload_dir, filename,
-            as_attachment=True,
-            download_name=dl_name,
-        )
+        return Response(metrics.registry.render(),
+                        mimetype='text/plain; version=0.0.4; charset=utf-8')
 
+    metrics.STARTUP_DURATION.observe(time.perf_counter() - started)
+    # Flush now: under --preload this runs in the master, which never serves.
+    metrics.registry.flush(force=True)
     return app
 
 
@@ -0,0 +1 @@
+"""Load benchmarks for the submission site; see the README for usage."""
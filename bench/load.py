@@ -0,0 +1,350 @@
+"""
+End-to-end load benchmark.
+
+Seeds (or reuses) a benchmark database, starts a local taiko-web stub and
+the app under a multi-worker server, then drives the main routes and
+reports p50/p95/p99 latency and SQL queries per request as JSON.
+
+``admin_approve`` approves pending submissions that have files, each of
+which uploads to the stub; they are put back to pending afterwards so the
+database can be reused for the next run.
+
+    python -m bench.load --db /tmp/bench.db --uploads /tmp/bench-uploads \\
+        --seed --output bench-$(git rev-parse --short HEAD).json
+    python -m bench.load --db /tmp/bench.db --uploads /tmp/bench-uploads \\
+        --output new.json --compare bench-abc1234.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from bench import stub_taiko
+from bench.seed import BENCH_PASSWORD, scratch_dirs, seed, summary_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ['community', 'community_ranked', 'submission_detail', 'comments_api', 'toggle_like',
+             'add_comment', 'download_file', 'admin_panel', 'admin_approve']
+ADMIN_SCENARIOS = {'admin_panel', 'admin_approve'}
+
+
+# ── Server management ────────────────────────────────────────────────────
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _have_gunicorn():
+    try:
+        import gunicorn  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def start_server(db_path, uploads, taiko_url, workers, port):
+    """Start the app in a subprocess and return (process, base_url)."""
+    # Metric counters would otherwise carry over from the previous run.
+    for d in scratch_dirs(db_path):
+        shutil.rmtree(d, ignore_errors=True)
+    # Per-request access logs would flood the terminal; match gunicorn's level.
+    env = dict(os.environ, BENCH_DB=db_path, BENCH_UPLOADS=uploads,
+               BENCH_TAIKO_URL=taiko_url, PYTHONPATH=ROOT,
+               LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    if _have_gunicorn():
+        cmd = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+               'bench.wsgi:app']
+    else:
+        cmd = [sys.executable, '-c',
+               'from werkzeug.serving import run_simple; from bench.wsgi import app; '
+               f'run_simple("127.0.0.1", {port}, app, processes={workers})']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with code {proc.returncode}')
+        try:
+            requests.get(base + '/login', timeout=5)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError('server did not come up within 60 s')
+
+
+# ── Clients ──────────────────────────────────────────────────────────────
+
+class Client:
+    """A logged-in requests.Session plus the ids it may target."""
+
+    def __init__(self, base, username, ids):
+        self.base = base
+        self.ids = ids
+        self.rnd = random.Random(username)
+        self.session = requests.Session()
+        resp = self.session.post(base + '/login', allow_redirects=False,
+                                 data={'username': username, 'password': BENCH_PASSWORD})
+        if resp.status_code != 302:
+            raise RuntimeError(f'login failed for {username}: HTTP {resp.status_code}')
+
+    def community(self):
+        page = self.rnd.randint(1, 50)
+        return self.session.get(f'{self.base}/community?page={page}')
+
+    def community_ranked(self):
+        sort = self.rnd.choice(('hot', 'likes', 'comments'))
+        page = self.rnd.randint(1, 50)
+        return self.session.get(f'{self.base}/community?sort={sort}&page={page}')
+
+    def submission_detail(self):
+        sid = self.rnd.choice(self.ids['approved'])
+        return self.session.get(f'{self.base}/submission/{sid}')
+
+    def comments_api(self):
+        # First page plus the next one, like a reader scrolling the comments.
+        sid = self.rnd.choice(self.ids['approved'])
+        url = f'{self.base}/api/submissions/{sid}/comments'
+        resp = self.session.get(url)
+        cursor = resp.json().get('next_cursor') if resp.ok else None
+        if cursor:
+            resp = self.session.get(url, params={'cursor': cursor})
+        return resp
+
+    def toggle_like(self):
+        sid = self.rnd.choice(self.ids['approved'])
+        return self.session.post(f'{self.base}/like/{sid}',
+                                 headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    def add_comment(self):
+        sid = self.rnd.choice(self.ids['approved'])
+        return self.session.post(f'{self.base}/comment/{sid}', allow_redirects=False,
+                                 data={'content': 'load test comment'})
+
+    def download_file(self):
+        sid = self.rnd.choice(self.ids['with_files'])
+        filetype = self.rnd.choice(('tja', 'ogg'))
+        return self.session.get(f'{self.base}/download/{sid}/{filetype}')
+
+    def admin_panel(self):
+        tab = self.rnd.choice(('pending', 'approved', 'rejected'))
+        page = self.rnd.randint(1, 5)
+        return self.session.get(f'{self.base}/1128admin1128?tab={tab}&page={page}')
+
+    def admin_approve(self):
+        # Shared by every client; list.pop() is atomic, so each id is approved once.
+        sid = self.ids['pending'].pop()
+        return self.session.post(f'{self.base}/1128admin1128/review/{sid}', allow_redirects=False,
+                                 data={'action': 'approve', 'review_note': 'load test'})
+
+
+def _target_ids(db_path, files):
+    con = sqlite3.connect(db_path)
+    try:
+        approved = [r[0] for r in con.execute(
+            "SELECT id FROM submissions WHERE status = 'approved' ORDER BY id")]
+        pending = [r[0] for r in con.execute(
+            "SELECT id FROM submissions WHERE status = 'pending' AND id <= ? ORDER BY id", (files,))]
+    finally:
+        con.close()
+    with_files = [sid for sid in approved if sid <= files] or approved[:1]
+    return {'approved': approved, 'with_files': with_files, 'pending': pending}
+
+
+def _restore_pending(db_path, sids):
+    """Undo admin_approve; return how many of `sids` it had approved."""
+    con = sqlite3.connect(db_path)
+    try:
+        marks = ','.join('?' * len(sids))
+        approved = con.execute(f"SELECT COUNT(*) FROM submissions WHERE status = 'approved' "
+                               f"AND id IN ({marks})", sids).fetchone()[0]
+        with con:
+            con.execute(f"UPDATE submissions SET status = 'pending', reviewed_at = NULL, "
+                        f"review_note = '' WHERE id IN ({marks})", sids)
+            for table in ('submission_ranks', 'deliveries'):
+                try:
+                    con.execute(f'DELETE FROM {table} WHERE submission_id IN ({marks})', sids)
+                except sqlite3.OperationalError:  # table not in this revision's schema
+                    pass
+    finally:
+        con.close()
+    return approved
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(clients, name, total, concurrency):
+    """Issue `total` requests for one scenario and return its stats."""
+    latencies, queries = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        client = clients[i % len(clients)]
+        t0 = time.perf_counter()
+        try:
+            resp = getattr(client, name)()
+            _ = resp.content
+            ok = resp.status_code < 400
+            q = resp.headers.get('X-Bench-Queries')
+        except requests.RequestException:
+            ok, q = False, None
+        elapsed = (time.perf_counter() - t0) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if q is not None:
+                queries.append(int(q))
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': round(total / wall, 1) if wall else None,
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(_percentile(latencies, 50), 2),
+        'p95_ms': round(_percentile(latencies, 95), 2),
+        'p99_ms': round(_percentile(latencies, 99), 2),
+        'queries_per_request': round(statistics.fmean(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+# ── Reporting ────────────────────────────────────────────────────────────
+
+def _git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    """Print p95 and queries-per-request deltas against an earlier result."""
+    print(f"{'scenario':<20}{'p95 ms':>18}{'queries/req':>18}")
+    for name, cur in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            print(f'{name:<20}{cur["p95_ms"]:>18}{str(cur["queries_per_request"]):>18}')
+            continue
+        p95 = f'{old["p95_ms"]} → {cur["p95_ms"]}'
+        qpr = f'{old["queries_per_request"]} → {cur["queries_per_request"]}'
+        print(f'{name:<20}{p95:>18}{qpr:>18}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark')
+    parser.add_argument('--db', required=True, help='benchmark SQLite file')
+    parser.add_argument('--uploads', required=True, help='benchmark upload folder')
+    parser.add_argument('--seed', action='store_true', help='(re)seed before running')
+    parser.add_argument('--submissions', type=int, default=100_000)
+    parser.add_argument('--likes', type=int, default=1_000_000)
+    parser.add_argument('--comments', type=int, default=500_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--files', type=int, default=2_000,
+                        help='submissions that get real files on disk')
+    parser.add_argument('--workers', type=int, default=4, help='server worker processes')
+    parser.add_argument('--concurrency', type=int, default=16, help='client threads')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='earlier JSON result to diff against')
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    uploads = os.path.abspath(args.uploads)
+    if args.seed or not os.path.exists(db_path):
+        print('seeding...', flush=True)
+        seeded = seed(db_path, uploads, args.users, args.submissions,
+                      args.likes, args.comments, args.files)
+        print(seeded, flush=True)
+    else:
+        with open(summary_path(db_path), 'r', encoding='utf-8') as f:
+            seeded = json.load(f)
+
+    stub = stub_taiko.start_in_thread()
+    taiko_url = f'http://127.0.0.1:{stub.server_port}'
+    proc, base = start_server(db_path, uploads, taiko_url, args.workers, _free_port())
+    try:
+        ids = _target_ids(db_path, seeded['files'])
+        n_clients = max(1, args.concurrency)
+        clients = [Client(base, f'user{i + 1}', ids) for i in range(n_clients)]
+        admins = [Client(base, 'benchadmin', ids) for _ in range(n_clients)]
+
+        results = {}
+        for name in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+            if name not in SCENARIOS:
+                parser.error(f'unknown scenario {name!r}')
+            pool = admins if name in ADMIN_SCENARIOS else clients
+            if name == 'admin_approve':
+                # Each request consumes a pending submission with files.
+                sids = list(ids['pending'])
+                total = min(args.requests, len(sids))
+                if not total:
+                    print(f'{name:<20} skipped: no pending submissions with files', flush=True)
+                    continue
+                results[name] = run_scenario(pool, name, total, args.concurrency)
+                results[name]['approved'] = _restore_pending(db_path, sids[-total:])
+                ids['pending'][:] = sids
+            else:
+                results[name] = run_scenario(pool, name, args.requests, args.concurrency)
+            r = results[name]
+            print(f'{name:<20} p50={r["p50_ms"]}ms p95={r["p95_ms"]}ms '
+                  f'p99={r["p99_ms"]}ms q/req={r["queries_per_request"]} '
+                  f'errors={r["errors"]}', flush=True)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        stub.shutdown()
+
+    report = {
+        'git_rev': _git_rev(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'server': 'gunicorn' if _have_gunicorn() else 'werkzeug',
+        'workers': args.workers,
+        'concurrency': args.concurrency,
+        'seed': seeded,
+        'stub_uploads': stub.state.snapshot(),
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Seed a benchmark database with realistic volumes.
+
+    python -m bench.seed --db /tmp/bench.db --uploads /tmp/bench-uploads
+
+Rows are inserted with bulk executemany in one transaction per table, so
+the default volumes (100k submissions, 1M likes, 500k comments) take a
+minute or two on SQLite rather than hours through the ORM.
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_PASSWORD = 'benchpass'
+CHUNK = 50_000
+
+SONG_TYPES = [
+    '01 Pop', '02 Anime', '03 Vocaloid', '04 Children and Folk', '05 Variety',
+    '06 Classical', '07 Game Music', '08 Live Festival Mode', '09 Namco Original',
+]
+
+TJA_BODY = b'TITLE:bench\nBPM:120\nWAVE:music.ogg\nCOURSE:Oni\nLEVEL:8\n#START\n1010,\n#END\n'
+
+
+def _bulk(db, table, rows):
+    for i in range(0, len(rows), CHUNK):
+        db.session.execute(table.insert(), rows[i:i + CHUNK])
+
+
+def seed(db_path, uploads, users=20_000, submissions=100_000, likes=1_000_000,
+         comments=500_000, files=2_000, ogg_bytes=256 * 1024, seed_value=1128):
+    """Create and fill the benchmark database; return a summary dict."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ['BENCH_DB'] = db_path
+    os.environ['BENCH_UPLOADS'] = uploads
+
+    from bench.wsgi import app
+    from models import db, User, Submission, Comment, Like
+    import ranking
+
+    rnd = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+
+    with app.app_context():
+        db.create_all()
+        # One hash for everyone: hashing 20k passwords would dominate seeding.
+        proto = User(username='x', email='x')
+        proto.set_password(BENCH_PASSWORD)
+        pw_hash = proto.password_hash
+
+        # The app may already have bootstrapped an admin as user 1.
+        db.session.execute(User.__table__.delete())
+        user_rows = [{
+            'id': i + 1,
+            'username': 'benchadmin' if i == 0 else f'user{i}',
+            'email': f'user{i}@bench.local',
+            'password_hash': pw_hash,
+            'is_admin': i == 0,
+            'created_at': now - timedelta(days=365),
+        } for i in range(users)]
+        _bulk(db, User.__table__, user_rows)
+        del user_rows
+
+        sub_rows = []
+        for i in range(submissions):
+            created = now - timedelta(minutes=submissions - i)
+            r = rnd.random()
+            if r < 0.85:
+                status, reviewed = Submission.STATUS_APPROVED, created + timedelta(minutes=5)
+            elif r < 0.93:
+                status, reviewed = Submission.STATUS_PENDING, None
+            elif r < 0.97:
+                status, reviewed = Submission.STATUS_REJECTED, created + timedelta(minutes=5)
+            else:
+                status, reviewed = Submission.STATUS_CANCELLED, None
+            sub_rows.append({
+                'id': i + 1,
+                'user_id': rnd.randint(1, users),
+                'title': f'Bench Song {i + 1}',
+                'artist': f'Artist {i % 997}',
+                'tja_filename': 'main.tja',
+                'ogg_filename': 'music.ogg',
+                'song_type': SONG_TYPES[i % len(SONG_TYPES)],
+                'status': status,
+                'created_at': created,
+                'reviewed_at': reviewed,
+                'review_note': '',
+            })
+        _bulk(db, Submission.__table__, sub_rows)
+        del sub_rows
+
+        # Unique (user, submission) pairs with a popularity skew: each user
+        # likes a run of submissions starting at a low, skewed offset.
+        per_user = max(1, min(likes // users, submissions))
+        like_total = 0
+        like_rows = []
+        for u in range(1, users + 1):
+            start = int(submissions * rnd.random() ** 3)
+            liked = {(start + k * 7) % submissions + 1 for k in range(per_user)}
+            like_total += len(liked)
+            for sid in liked:
+                like_rows.append({'user_id': u, 'submission_id': sid, 'created_at': now})
+                if len(like_rows) >= CHUNK:
+                    _bulk(db, Like.__table__, like_rows)
+                    like_rows = []
+        _bulk(db, Like.__table__, like_rows)
+        del like_rows
+
+        comment_rows = []
+        for i in range(comments):
+            comment_rows.append({
+                'user_id': rnd.randint(1, users),
+                'submission_id': int(submissions * rnd.random() ** 3) + 1,
+                'content': f'bench comment {i}',
+                'created_at': now - timedelta(seconds=comments - i),
+            })
+            if len(comment_rows) >= CHUNK:
+                _bulk(db, Comment.__table__, comment_rows)
+                comment_rows = []
+        _bulk(db, Comment.__table__, comment_rows)
+        db.session.commit()
+        ranking.rebuild(log=lambda msg: None)
+
+    # Only a slice of submissions gets real files: enough for download_file
+    # to spread over, without writing 100k directories.
+    ogg = bytes(rnd.getrandbits(8) for _ in range(1024)) * (ogg_bytes // 1024)
+    for sid in range(1, min(files, submissions) + 1):
+        d = os.path.join(uploads, str(sid))
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, 'main.tja'), 'wb') as f:
+            f.write(TJA_BODY)
+        with open(os.path.join(d, 'music.ogg'), 'wb') as f:
+            f.write(ogg)
+
+    summary = {
+        'users': users,
+        'submissions': submissions,
+        'likes': like_total,
+        'comments': comments,
+        'files': min(files, submissions),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    with open(summary_path(db_path), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def summary_path(db_path):
+    """Where seed() records what it generated, next to the database."""
+    return db_path + '.seed.json'
+
+
+def scratch_dirs(db_path):
+    """(METRICS_DIR, PROFILE_DIR) of the app under benchmark, next to the database."""
+    return db_path + '.metrics', db_path + '.profiles'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a benchmark database')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--uploads', required=True)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--submissions', type=int, default=100_000)
+    parser.add_argument('--likes', type=int, default=1_000_000)
+    parser.add_argument('--comments', type=int, default=500_000)
+    parser.add_argument('--files', type=int, default=2_000,
+                        help='submissions that get real files on disk')
+    args = parser.parse_args()
+    summary = seed(os.path.abspath(args.db), os.path.abspath(args.uploads),
+                   args.users, args.submissions, args.likes, args.comments, args.files)
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
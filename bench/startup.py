@@ -0,0 +1,84 @@
+"""
+Worker startup benchmark.
+
+Times how long a fresh process takes to import ``app`` (what every gunicorn
+worker does after ``systemctl reload`` without --preload), with the
+in-process bootstrap on (AUTO_INIT_DB=1) and off (AUTO_INIT_DB=0, the
+production setting once ``flask init-db`` has run). create_app() itself is
+reported separately from the in-process ``taiko_app_startup_seconds`` metric.
+
+    python -m bench.startup --db /tmp/bench.db --runs 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import time, json
+t0 = time.perf_counter()
+import app, metrics
+total = time.perf_counter() - t0
+h = metrics.STARTUP_DURATION.values
+entry = next(iter(h.values()))
+print(json.dumps({"import": total, "create_app": entry[-2] / entry[-1]}))
+'''
+
+
+def run(db_path, auto_init, runs, workers):
+    """Start `workers` processes at once, `runs` times; return timings."""
+    env = dict(os.environ, PYTHONPATH=ROOT, AUTO_INIT_DB='1' if auto_init else '0',
+               METRICS_DIR=tempfile.mkdtemp(prefix='taiko-startup-metrics-'))
+    uploads = tempfile.mkdtemp(prefix='taiko-startup-uploads-')
+    code = ('from config import Config\n'
+            f'Config.SQLALCHEMY_DATABASE_URI = {"sqlite:///" + db_path!r}\n'
+            f'Config.UPLOAD_FOLDER = {uploads!r}\n' + PROBE)
+    imports, creates = [], []
+    for _ in range(runs):
+        procs = [subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                  stdout=subprocess.PIPE, text=True)
+                 for _ in range(workers)]
+        for p in procs:
+            out, _ = p.communicate()
+            if p.returncode != 0:
+                raise RuntimeError('probe process failed')
+            r = json.loads(out.strip().splitlines()[-1])
+            imports.append(r['import'] * 1000)
+            creates.append(r['create_app'] * 1000)
+    return {
+        'import_ms_p50': round(statistics.median(imports), 1),
+        'import_ms_max': round(max(imports), 1),
+        'create_app_ms_p50': round(statistics.median(creates), 1),
+        'create_app_ms_max': round(max(creates), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker startup benchmark')
+    parser.add_argument('--db', required=True, help='existing (initialised) SQLite file')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4, help='processes started together')
+    parser.add_argument('--output', help='write JSON results here')
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    report = {
+        'workers': args.workers,
+        'runs': args.runs,
+        'auto_init_db': run(db_path, True, args.runs, args.workers),
+        'explicit_init_db': run(db_path, False, args.runs, args.workers),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Local stand-in for an S3-compatible object store (MinIO, R2, ...).
+
+Implements the part of the S3 REST API that ``storage.S3Storage`` uses,
+in memory and path-style only: buckets, Put/Get/Head object,
+ListObjectsV2 (with pagination), DeleteObjects and multipart uploads.
+Enough to run the S3 backend without an account or a MinIO install:
+
+    python -m bench.stub_s3 --port 9100 --bucket taiko
+
+then point the app at it with STORAGE_BACKEND=s3,
+S3_ENDPOINT_URL=http://127.0.0.1:9100 and any access key. Credentials
+and signatures are not checked. ``bench.s3_check`` runs the storage
+operations against it.
+"""
+import argparse
+import hashlib
+import threading
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+_NS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+_STREAMING = ('STREAMING-UNSIGNED-PAYLOAD-TRAILER', 'STREAMING-AWS4-HMAC-SHA256-PAYLOAD',
+              'STREAMING-AWS4-HMAC-SHA256-PAYLOAD-TRAILER')
+
+
+class _Object:
+    def __init__(self, data, content_type):
+        self.data = data
+        self.content_type = content_type
+        self.etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+class StubState:
+    """Buckets and pending multipart uploads, shared by all handler threads."""
+
+    def __init__(self, buckets=()):
+        self.lock = threading.Lock()
+        self.buckets = {name: {} for name in buckets}
+        self.uploads = {}  # upload id -> (bucket, key, content type, {part number: bytes})
+        self.requests = 0
+
+
+def _decode_aws_chunked(body):
+    """Strip aws-chunked framing: <hex size>[;chunk-signature=...]\\r\\n<data>\\r\\n ... 0\\r\\n<trailers>."""
+    out = []
+    pos = 0
+    while True:
+        eol = body.index(b'\r\n', pos)
+        size = int(body[pos:eol].split(b';', 1)[0], 16)
+        if size == 0:
+            return b''.join(out)
+        start = eol + 2
+        out.append(body[start:start + size])
+        pos = start + size + 2
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # set by make_server()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # ── Plumbing ────────────────────────────────────────────────────────
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = unquote(parts.path).lstrip('/').partition('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        with self.state.lock:
+            self.state.requests += 1
+        return bucket, key, query
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            data = self._read_http_chunks()
+        else:
+            data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        # Newer botocore sends streaming uploads aws-chunked, with a checksum trailer.
+        if self.headers.get('x-amz-content-sha256') in _STREAMING or \
+                'aws-chunked' in self.headers.get('Content-Encoding', ''):
+            data = _decode_aws_chunked(data)
+        return data
+
+    def _read_http_chunks(self):
+        out = []
+        while True:
+            size = int(self.rfile.readline().split(b';', 1)[0], 16)
+            if size == 0:
+                while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(out)
+            out.append(self.rfile.read(size))
+            self.rfile.readline()
+
+    def _send(self, status, body=b'', headers=None, content_type='application/xml'):
+        self.send_response(status)
+        if body or content_type == 'application/xml':
+            self.send_header('Content-Type', content_type)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _xml(self, status, root, inner, ns=_NS):
+        xmlns = f' xmlns="{ns}"' if ns else ''
+        body = f'<?xml version="1.0" encoding="UTF-8"?><{root}{xmlns}>{inner}</{root}>'
+        self._send(status, body.encode('utf-8'))
+
+    def _error(self, status, code, message=''):
+        if self.command == 'HEAD':
+            self._send(status, content_type='application/xml')
+            return
+        self._xml(status, 'Error', f'<Code>{code}</Code><Message>{escape(message or code)}</Message>',
+                  ns=None)
+
+    def _bucket(self, name):
+        objects = self.state.buckets.get(name)
+        if objects is None:
+            self._error(404, 'NoSuchBucket', name)
+        return objects
+
+    # ── Verbs ───────────────────────────────────────────────────────────
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        data = self._body()
+        with self.state.lock:
+            if not key:
+                self.state.buckets.setdefault(bucket, {})
+                self._send(200, headers={'Location': '/' + bucket})
+                return
+            if 'uploadId' in query:
+                upload = self.state.uploads.get(query['uploadId'])
+                if upload is None:
+                    self._error(404, 'NoSuchUpload')
+                    return
+                upload[3][int(query['partNumber'])] = data
+                self._send(200, headers={'ETag': '"' + hashlib.md5(data).hexdigest() + '"'})
+                return
+            objects = self._bucket(bucket)
+            if objects is None:
+                return
+            obj = _Object(data, self.headers.get('Content-Type', 'application/octet-stream'))
+            objects[key] = obj
+        self._send(200, headers={'ETag': obj.etag})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        data = self._body()
+        with self.state.lock:
+            objects = self._bucket(bucket)
+            if objects is None:
+                return
+            if 'delete' in query:
+                doc = ElementTree.fromstring(data)
+                deleted = []
+                for el in doc.iter():
+                    if el.tag.rsplit('}', 1)[-1] == 'Key':
+                        objects.pop(el.text, None)
+                        deleted.append(f'<Deleted><Key>{escape(el.text)}</Key></Deleted>')
+                self._xml(200, 'DeleteResult', ''.join(deleted))
+            elif 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                self.state.uploads[upload_id] = (
+                    bucket, key, self.headers.get('Content-Type', 'application/octet-stream'), {})
+                self._xml(200, 'InitiateMultipartUploadResult',
+                          f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                          f'<UploadId>{upload_id}</UploadId>')
+            elif 'uploadId' in query:
+                upload = self.state.uploads.pop(query['uploadId'], None)
+                if upload is None:
+                    self._error(404, 'NoSuchUpload')
+                    return
+                _, _, content_type, parts = upload
+                obj = _Object(b''.join(parts[n] for n in sorted(parts)), content_type)
+                objects[key] = obj
+                self._xml(200, 'CompleteMultipartUploadResult',
+                          f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                          f'<ETag>{escape(obj.etag)}</ETag>')
+            else:
+                self._error(400, 'NotImplemented', 'unsupported POST')
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        with self.state.lock:
+            if 'uploadId' in query:
+                self.state.uploads.pop(query['uploadId'], None)
+            else:
+                objects = self._bucket(bucket)
+                if objects is None:
+                    return
+                objects.pop(key, None)
+        self._send(204, content_type='')
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        with self.state.lock:
+            objects = self._bucket(bucket)
+            if objects is None:
+                return
+            if not key:
+                self._list(bucket, objects, query)
+                return
+            obj = objects.get(key)
+        if obj is None:
+            self._error(404, 'NoSuchKey', key)
+            return
+        self._send(200, obj.data, self._object_headers(obj), obj.content_type)
+
+    def do_HEAD(self):
+        bucket, key, _ = self._parse()
+        with self.state.lock:
+            objects = self.state.buckets.get(bucket)
+            obj = objects.get(key) if objects is not None and key else None
+        if obj is None:
+            self._send(404 if key else (200 if objects is not None else 404), content_type='')
+            return
+        # Content-Length is the object's size, but HEAD sends no body.
+        self.send_response(200)
+        self.send_header('Content-Type', obj.content_type)
+        for k, v in self._object_headers(obj).items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(obj.data)))
+        self.end_headers()
+
+    def _object_headers(self, obj):
+        return {'ETag': obj.etag, 'Last-Modified': format_datetime(obj.modified, usegmt=True)}
+
+    def _list(self, bucket, objects, query):
+        prefix = query.get('prefix', '')
+        max_keys = int(query.get('max-keys') or 1000)
+        after = query.get('continuation-token') or query.get('start-after') or ''
+        keys = sorted(k for k in objects if k.startswith(prefix) and k > after)
+        page, more = keys[:max_keys], len(keys) > max_keys
+        contents = ''.join(
+            f'<Contents><Key>{escape(k)}</Key>'
+            f'<LastModified>{objects[k].modified.strftime("%Y-%m-%dT%H:%M:%S.000Z")}</LastModified>'
+            f'<ETag>{escape(objects[k].etag)}</ETag><Size>{len(objects[k].data)}</Size>'
+            f'<StorageClass>STANDARD</StorageClass></Contents>' for k in page)
+        token = f'<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>' if more else ''
+        self._xml(200, 'ListBucketResult',
+                  f'<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+                  f'<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+                  f'<IsTruncated>{"true" if more else "false"}</IsTruncated>{token}{contents}')
+
+
+def make_server(host='127.0.0.1', port=0, buckets=()):
+    """Return a ThreadingHTTPServer bound to (host, port); port 0 picks one."""
+    state = StubState(buckets)
+    handler = type('BoundStubHandler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, buckets=()):
+    """Start a stub server on a daemon thread and return it."""
+    server = make_server(host, port, buckets)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local in-memory S3 stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--bucket', action='append', default=[], help='create this bucket (repeatable)')
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.bucket)
+    print(f'stub S3 listening on http://{args.host}:{server.server_port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
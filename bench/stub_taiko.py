@@ -0,0 +1,275 @@
+"""
+Local stand-in for a taiko-web server.
+
+Implements just enough of ``api/upload`` and ``api/songs`` for the
+submission site and the ESE uploader to talk to it instead of taiko.asia,
+and can inject faults so the upload retry paths can be exercised:
+
+    python -m bench.stub_taiko --port 8765 --latency 0.2 --bandwidth 2000000 \\
+        --reset-rate 0.1 --error-rate 0.1 --throttle-rate 0.05 --drip-rate 0.05
+
+Faults can also be changed while running by POSTing a JSON object with
+any FaultConfig field to ``/_stub/config``; ``/_stub/stats`` reports what
+the stub has seen.
+"""
+import argparse
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SONG_TYPE_RE = re.compile(rb'name="song_type"\r\n\r\n([^\r]*)\r\n')
+_TITLE_RE = re.compile(rb'(?m)^TITLE:([^\r\n]*)')
+
+
+@dataclass
+class FaultConfig:
+    """What the stub does to each api/upload request; rates are 0..1."""
+    latency: float = 0.0          # seconds before handling each request
+    latency_jitter: float = 0.0   # extra uniform 0..jitter seconds
+    bandwidth: int = 0            # request body bytes/s, 0 = unlimited
+    reset_rate: float = 0.0       # reset the connection mid-upload
+    error_rate: float = 0.0       # answer with error_status
+    error_status: int = 503
+    throttle_rate: float = 0.0    # answer 429 with Retry-After
+    retry_after: float = 1.0
+    drip_rate: float = 0.0        # send the success body one byte at a time
+    drip_interval: float = 0.5
+    down: bool = False            # reset every connection immediately
+    seed: int = 1128
+
+    def update(self, values):
+        names = {f.name for f in fields(self)}
+        for key, value in values.items():
+            if key in names:
+                setattr(self, key, type(getattr(self, key))(value))
+
+
+class StubState:
+    """Counters shared by all handler threads."""
+
+    def __init__(self, faults=None):
+        self.lock = threading.Lock()
+        self.faults = faults or FaultConfig()
+        self.rnd = random.Random(self.faults.seed)
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.attempts = 0
+        self.attempt_bytes = 0
+        self.outcomes = {}
+        self.songs = []
+
+    def pick_outcome(self):
+        """Choose the fate of one upload request."""
+        with self.lock:
+            f = self.faults
+            self.attempts += 1
+            if f.down:
+                return 'down'
+            r = self.rnd.random()
+            for name, rate in (('reset', f.reset_rate), ('error', f.error_rate),
+                               ('throttle', f.throttle_rate)):
+                if r < rate:
+                    return name
+                r -= rate
+            return 'drip' if self.rnd.random() < f.drip_rate else 'ok'
+
+    def record(self, outcome, nbytes, song_type='', title=''):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.attempt_bytes += nbytes
+            if outcome in ('ok', 'drip'):
+                self.uploads += 1
+                self.upload_bytes += nbytes
+                self.songs.append({'category': song_type,
+                                   'title': title or f'stub-{self.uploads}'})
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uploads': self.uploads,
+                'upload_bytes': self.upload_bytes,
+                'attempts': self.attempts,
+                'attempt_bytes': self.attempt_bytes,
+                'wasted_bytes': self.attempt_bytes - self.upload_bytes,
+                'outcomes': dict(self.outcomes),
+                'faults': asdict(self.faults),
+            }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # set by make_server()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def finish(self):
+        try:
+            super().finish()
+        except (OSError, ValueError):
+            pass  # connection already reset on purpose
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drip_json(self, payload, interval):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(len(body)):
+            self.wfile.write(body[i:i + 1])
+            self.wfile.flush()
+            time.sleep(interval)
+
+    def _reset(self):
+        """Abort the TCP connection with an RST instead of a clean close."""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                   struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = True
+
+    def _read_body(self, limit=None, bandwidth=0):
+        """Read the request body (optionally only `limit` bytes) at `bandwidth` B/s."""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        if limit is not None:
+            remaining = min(remaining, limit)
+        chunk_size = max(1024, bandwidth // 10) if bandwidth else 64 * 1024
+        parts = []
+        while remaining > 0:
+            t0 = time.monotonic()
+            chunk = self.rfile.read(min(remaining, chunk_size))
+            if not chunk:
+                break
+            parts.append(chunk)
+            remaining -= len(chunk)
+            if bandwidth:
+                spare = len(chunk) / bandwidth - (time.monotonic() - t0)
+                if spare > 0:
+                    time.sleep(spare)
+        return b''.join(parts)
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path.endswith('_stub/config'):
+            values = json.loads(self._read_body() or b'{}')
+            with self.state.lock:
+                self.state.faults.update(values)
+                faults = asdict(self.state.faults)
+            self._send_json(200, faults)
+            return
+        if not path.endswith('api/upload'):
+            self._read_body()
+            self._send_json(404, {'success': False, 'error': 'not found'})
+            return
+
+        faults = self.state.faults
+        outcome = self.state.pick_outcome()
+        if outcome == 'down':
+            self.state.record(outcome, 0)
+            self._reset()
+            return
+        delay = faults.latency + faults.latency_jitter * self.state.rnd.random()
+        if delay:
+            time.sleep(delay)
+        if outcome == 'reset':
+            # Take half the body first so the client has wasted real bandwidth.
+            half = int(self.headers.get('Content-Length') or 0) // 2
+            body = self._read_body(half, faults.bandwidth)
+            self.state.record(outcome, len(body))
+            self._reset()
+            return
+
+        body = self._read_body(bandwidth=faults.bandwidth)
+        m = _SONG_TYPE_RE.search(body)
+        song_type = m.group(1).decode('utf-8', 'replace') if m else ''
+        m = _TITLE_RE.search(body)
+        title = m.group(1).decode('utf-8', 'replace').strip() if m else ''
+        self.state.record(outcome, len(body), song_type, title)
+        if outcome == 'error':
+            self._send_json(faults.error_status, {'success': False, 'error': 'injected'})
+        elif outcome == 'throttle':
+            self._send_json(429, {'success': False, 'error': 'slow down'},
+                            {'Retry-After': f'{faults.retry_after:g}'})
+        elif outcome == 'drip':
+            self._drip_json({'success': True}, faults.drip_interval)
+        else:
+            self._send_json(200, {'success': True})
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path.endswith('api/songs'):
+            if self.state.faults.down:
+                self._reset()
+                return
+            with self.state.lock:
+                songs = list(self.state.songs)
+            self._send_json(200, songs)
+        elif path.endswith('_stub/stats'):
+            self._send_json(200, self.state.snapshot())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+
+def make_server(host='127.0.0.1', port=0, faults=None):
+    """Return a ThreadingHTTPServer bound to (host, port); port 0 picks one."""
+    state = StubState(faults)
+    handler = type('BoundStubHandler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(host='127.0.0.1', port=0, faults=None):
+    """Start a stub server on a daemon thread and return it."""
+    server = make_server(host, port, faults)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+def add_fault_arguments(parser):
+    """Expose every FaultConfig field as a --kebab-case option."""
+    for f in fields(FaultConfig):
+        flag = '--' + f.name.replace('_', '-')
+        if isinstance(f.default, bool):
+            parser.add_argument(flag, action='store_true')
+        else:
+            parser.add_argument(flag, type=type(f.default), default=f.default)
+
+
+def faults_from_args(args):
+    return FaultConfig(**{f.name: getattr(args, f.name) for f in fields(FaultConfig)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local taiko-web api/upload stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, faults_from_args(args))
+    print(f'stub taiko-web listening on http://{args.host}:{server.server_port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
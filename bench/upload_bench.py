@@ -0,0 +1,145 @@
+"""
+Upload-path benchmark against the fault-injecting taiko-web stand-in.
+
+Builds a synthetic ESE tree, starts ``bench.stub_taiko`` with the
+requested faults, then pushes every song through either the ESE CLI
+(``--target cli``, run as a subprocess exactly like a user would) or the
+web app's ``utils.upload_to_taiko_server`` (``--target web``, with the
+retry policy the app builds from ``Config``). Reports wall time, upload
+throughput, how much work retries wasted and the policy used, as JSON.
+
+    python -m bench.upload_bench --songs 40 --ogg-kb 2048 \\
+        --reset-rate 0.1 --error-rate 0.1 --throttle-rate 0.05 --output up.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import stub_taiko
+from retry_policy import RetryPolicy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_SCRIPT = os.path.join(ROOT, '谱面本地上传工具.py')
+
+SONG_TYPES = ['01 Pop', '02 Anime', '03 Vocaloid', '05 Variety', '07 Game Music']
+
+
+def make_ese_tree(root, songs, ogg_bytes, seed_value=1128):
+    """Create `songs` song folders under root/ESE and return the ESE path."""
+    rnd = random.Random(seed_value)
+    ese = os.path.join(root, 'ESE')
+    block = bytes(rnd.getrandbits(8) for _ in range(4096))
+    ogg = (block * (ogg_bytes // len(block) + 1))[:ogg_bytes]
+    songs_made = []
+    for i in range(songs):
+        song_type = SONG_TYPES[i % len(SONG_TYPES)]
+        title = f'Synthetic {i:04d}'
+        d = os.path.join(ese, song_type, title)
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f'{title}.tja'), 'w', encoding='utf-8') as f:
+            f.write(f'TITLE:{title}\nBPM:150\nWAVE:{title}.ogg\nCOURSE:Oni\nLEVEL:9\n'
+                    '#START\n1111,\n#END\n')
+        with open(os.path.join(d, f'{title}.ogg'), 'wb') as f:
+            f.write(ogg)
+        songs_made.append((song_type, d, title))
+    return ese, songs_made
+
+
+def run_cli(ese, url, workdir):
+    """Run the ESE uploader in upload mode; return (seconds, stdout lines)."""
+    # Run a copy so its uploaded.json lands in the scratch dir, not the repo.
+    script = os.path.join(workdir, os.path.basename(CLI_SCRIPT))
+    shutil.copy(CLI_SCRIPT, script)
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONUNBUFFERED='1')
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, script, ese, url, 'n', '1'],
+                         cwd=workdir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+    return elapsed, out.stdout.splitlines()
+
+
+def web_policy():
+    """The retry policy create_app() uses for remote uploads."""
+    from config import Config
+    return RetryPolicy.from_config(vars(Config))
+
+
+def run_web(songs, url, policy):
+    """Upload every song through the web app's helper; return (seconds, results)."""
+    from utils import upload_to_taiko_server
+
+    results = []
+    t0 = time.perf_counter()
+    for song_type, d, title in songs:
+        ok, msg = upload_to_taiko_server(
+            os.path.join(d, f'{title}.tja'), os.path.join(d, f'{title}.ogg'),
+            song_type, url, policy=policy)
+        results.append((ok, msg))
+    return time.perf_counter() - t0, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload-path benchmark with injected faults')
+    parser.add_argument('--target', choices=('cli', 'web'), default='cli')
+    parser.add_argument('--songs', type=int, default=20)
+    parser.add_argument('--ogg-kb', type=int, default=1024)
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    stub_taiko.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='taiko-upload-bench-')
+    stub = stub_taiko.start_in_thread(faults=stub_taiko.faults_from_args(args))
+    url = f'http://127.0.0.1:{stub.server_port}/'
+    try:
+        ese, songs = make_ese_tree(workdir, args.songs, args.ogg_kb * 1024)
+        if args.target == 'cli':
+            policy = RetryPolicy()  # the CLI's own defaults
+            wall, lines = run_cli(ese, url, workdir)
+            ok = sum(1 for line in lines if line.startswith('上传完成'))
+            failed = sum(1 for line in lines if line.startswith('上传失败'))
+            client_retries = sum(1 for line in lines if line.startswith('上传出错'))
+        else:
+            policy = web_policy()
+            wall, results = run_web(songs, url, policy)
+            ok = sum(1 for r, _ in results if r)
+            failed = len(results) - ok
+            client_retries = None
+    finally:
+        stub.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stats = stub.state.snapshot()
+    report = {
+        'target': args.target,
+        'songs': args.songs,
+        'ogg_bytes': args.ogg_kb * 1024,
+        'retry_policy': policy.as_dict(),
+        'wall_seconds': round(wall, 3),
+        'uploaded': ok,
+        'failed': failed,
+        'throughput_mb_s': round(stats['upload_bytes'] / wall / 1e6, 3) if wall else None,
+        'songs_per_second': round(ok / wall, 3) if wall else None,
+        'retry_waste': {
+            'extra_attempts': stats['attempts'] - stats['uploads'],
+            'wasted_bytes': stats['wasted_bytes'],
+            'client_reported_retries': client_retries,
+        },
+        'stub': stats,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
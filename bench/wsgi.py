@@ -0,0 +1,46 @@
+"""
+WSGI entry point used by the load benchmark.
+
+Points the app at the benchmark database/upload folder/stub server taken
+from the environment, keeps its metric files and profiles next to the
+database instead of in the checkout, and reports the number of SQL statements each
+request ran in an ``X-Bench-Queries`` response header.
+
+    BENCH_DB=/tmp/bench.db BENCH_UPLOADS=/tmp/bench-uploads \\
+        gunicorn --workers 4 bench.wsgi:app
+"""
+import os
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from bench.seed import scratch_dirs
+from config import Config
+
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(os.environ['BENCH_DB'])
+Config.METRICS_DIR, Config.PROFILE_DIR = scratch_dirs(os.path.abspath(os.environ['BENCH_DB']))
+Config.UPLOAD_FOLDER = os.path.abspath(os.environ['BENCH_UPLOADS'])
+Config.TAIKO_SERVER_URL = os.environ.get('BENCH_TAIKO_URL', 'http://127.0.0.1:8765')
+Config.WTF_CSRF_ENABLED = False
+
+_counter = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _counter.n = getattr(_counter, 'n', 0) + 1
+
+
+from app import app  # noqa: E402  (Config must be patched before import)
+
+
+@app.before_request
+def _reset_query_count():
+    _counter.n = 0
+
+
+@app.after_request
+def _report_query_count(response):
+    response.headers['X-Bench-Queries'] = str(getattr(_counter, 'n', 0))
+    return response
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+
+from models import db, User, Submission, SubmissionRank
+import delivery
+import ranking
+import sweeper
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no lock needed
+    fcntl = None
+
+
+# ─── Schema creation & admin bootstrap ───────────────────────────────────────
+#
+# Run explicitly with `flask init-db` / `flask create-admin` in production.
+# With AUTO_INIT_DB on (the default, for `python app.py`), create_app()
+# calls bootstrap() under an inter-process file lock, so several gunicorn
+# workers booting at once don't race each other on an empty database.
+
+@contextmanager
+def bootstrap_lock(db_uri):
+    """Exclusive lock shared by every process using the same database."""
+    if fcntl is None:
+        yield
+        return
+    digest = hashlib.sha1(db_uri.encode('utf-8')).hexdigest()[:12]
+    path = os.path.join(tempfile.gettempdir(), f'taiko-bootstrap-{digest}.lock')
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def init_db():
+    """Create any missing tables, columns and indexes. Safe to run repeatedly."""
+    db.create_all()
+    upgrade_schema()
+    # Closed before closed_at was added: without it sweep() never sees them.
+    if sweeper.backfill_closed_at():
+        db.session.commit()
+    # Approved before deliveries were tracked: they are on TAIKO_SERVER_URL.
+    if delivery.backfill_legacy(current_app.config.get('TAIKO_SERVER_URL')):
+        db.session.commit()
+    # First run after submission_ranks was introduced: fill it once.
+    if SubmissionRank.query.first() is None and \
+            Submission.query.filter_by(status=Submission.STATUS_APPROVED).first() is not None:
+        ranking.rebuild()
+
+
+def upgrade_schema():
+    """
+    create_all() skips tables that already exist, so columns and indexes
+    added to the models later are added here. Returns what was added.
+    """
+    added = []
+    insp = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            columns = {c['name'] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+                    added.append(f'{table.name}.{column.name}')
+            indexes = {i['name'] for i in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    added.append(index.name)
+    return added
+
+
+def ensure_admin(username, password, email='admin@taiko.local', reset=False):
+    """
+    Make sure an admin account exists.
+    If `reset` is set (`flask create-admin`), `username` is created or
+    promoted and its password replaced. Otherwise nothing happens when any
+    admin already exists, and a new account is only ever created: if a
+    regular user already has `username`, RuntimeError is raised rather than
+    handing that account admin rights and the default password.
+    Returns the admin User, or None if an existing admin was kept.
+    """
+    if not reset and User.query.filter_by(is_admin=True).first():
+        return None
+    user = User.query.filter_by(username=username).first()
+    if user is not None and not reset:
+        raise RuntimeError(f'用户名 {username} 已被普通用户占用，不会自动将其设为管理员；'
+                           f'请设置其他 ADMIN_USERNAME，或运行 flask create-admin 明确指定')
+    if user is None:
+        user = User(username=username, email=email)
+        db.session.add(user)
+    user.is_admin = True
+    user.set_password(password)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another process created it between our check and commit.
+        db.session.rollback()
+        return None
+    return user
+
+
+def bootstrap(app):
+    """Create tables and the default admin once, under the bootstrap lock."""
+    with bootstrap_lock(app.config['SQLALCHEMY_DATABASE_URI']):
+        with app.app_context():
+            init_db()
+            ensure_admin(os.environ.get('ADMIN_USERNAME', 'admin'),
+                         os.environ.get('ADMIN_PASSWORD', 'admin123'))
+            # Don't hand pooled connections to forked workers (--preload).
+            db.engine.dispose()
@@ -7,7 +7,54 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'taiko_submissions.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+    # 'local' (hash-sharded dirs under UPLOAD_FOLDER) or 's3' (needs boto3)
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET', 'taiko-submissions')
+    S3_PREFIX = os.environ.get('S3_PREFIX', 'uploads/')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. http://127.0.0.1:9000 for MinIO
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB max upload
+    # Per-user storage quota in MB (0 = unlimited), checked on every upload
+    USER_QUOTA_BYTES = int(os.environ.get('USER_QUOTA_MB', '0')) * 1024 * 1024
+    # `flask sweep`: files of cancelled/rejected submissions are kept this long
+    SWEEP_RETENTION_DAYS = int(os.environ.get('SWEEP_RETENTION_DAYS', '30'))
+    SWEEP_ORPHAN_GRACE_HOURS = 24  # files without a submission row younger than this are kept
     TAIKO_SERVER_URL = 'https://taiko.asia'
+    # Every taiko-web server an approved chart is published to (comma-separated
+    # in the env); empty means just TAIKO_SERVER_URL. See delivery.py.
+    TAIKO_SERVER_URLS = [u.strip() for u in os.environ.get('TAIKO_SERVER_URLS', '').split(',') if u.strip()]
     USE_PROXY = False
     PROXY_URL = 'http://127.0.0.1:10808'
+    # Create tables/default admin inside create_app(). Production runs
+    # `flask init-db` / `flask create-admin` instead and sets AUTO_INIT_DB=0.
+    AUTO_INIT_DB = os.environ.get('AUTO_INIT_DB', '1') != '0'
+    # Per-process metric files merged by /metrics (see metrics.py)
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+    # JSON logs to stderr via a background writer (see jsonlog.py); LOG_FORMAT=text for dev
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_QUEUE_SIZE = 10000
+    # Request profiles (see profiling.py); empty PROFILE_DIR disables profiling
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))  # until set on the admin page
+    PROFILE_KEEP = 200
+    # Remote upload retries (see retry_policy.py)
+    UPLOAD_MAX_ATTEMPTS = 4
+    UPLOAD_BACKOFF_BASE = 2.0      # seconds; doubles each attempt, full jitter
+    UPLOAD_BACKOFF_MAX = 60.0
+    UPLOAD_RETRY_AFTER_MAX = 20.0  # longest Retry-After honoured
+    # No retry is started past this many seconds into an upload (redeliver
+    # picks it up later). Approval runs inside a gunicorn worker
+    # (--timeout 120 in setup.sh) and one attempt can take up to its 60 s
+    # request timeout on top, so keep this well below that.
+    UPLOAD_RETRY_BUDGET = 30.0
+    UPLOAD_BREAKER_THRESHOLD = 3   # consecutive failed requests (after retries) before failing fast
+    UPLOAD_BREAKER_RESET = 60.0    # seconds before a trial request is allowed
+    # /export.zip|tar: songs per response (?limit= may ask for fewer). One
+    # response has to finish within gunicorn's --timeout 120; mirrors page
+    # through the rest with since=<until> while "more" is true.
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '20'))
+    EXPORT_SLOTS = 1  # concurrent exports across all workers; others get 503
+    EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN', '')  # when set, required as ?token= or Bearer
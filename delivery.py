@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from models import db, Submission, Delivery
+
+# ─── Publishing approved charts to several taiko-web servers ─────────────────
+#
+# TAIKO_SERVER_URLS lists every server an approved chart goes to. Approval
+# uploads to all of them at once (one thread per server, the chart read
+# once), and each (submission, server) pair gets a Delivery row. A server
+# that failed, or was added to TAIKO_SERVER_URLS later, gets the chart on
+# its own from the admin panel or `flask redeliver`, without re-uploading
+# to the servers that have it.
+#
+# A submission is approved as soon as one server accepted it; if every
+# server fails it stays pending, as it did with a single server.
+
+
+def targets(config):
+    """The configured server URLs, in order, without duplicates."""
+    urls = config.get('TAIKO_SERVER_URLS') or [config['TAIKO_SERVER_URL']]
+    return list(dict.fromkeys(u.strip() for u in urls if u.strip()))
+
+
+def host_of(url):
+    """Short display name of a server URL."""
+    return urlsplit(url if '://' in url else 'https://' + url).netloc or url
+
+
+def undelivered(sub, urls):
+    """The servers in `urls` that don't have `sub` yet."""
+    done = {d.target for d in sub.deliveries if d.status == Delivery.STATUS_DELIVERED}
+    return [u for u in urls if u not in done]
+
+
+def fan_out(send, urls):
+    """Call send(url) for every url concurrently; return {url: (ok, message)}."""
+    if len(urls) <= 1:
+        return {u: send(u) for u in urls}
+    with ThreadPoolExecutor(max_workers=len(urls), thread_name_prefix='deliver') as pool:
+        futures = {u: pool.submit(send, u) for u in urls}
+        return {u: f.result() for u, f in futures.items()}
+
+
+def record(sub, results):
+    """Create or update the Delivery rows of `sub` from fan_out() results (no commit)."""
+    now = datetime.now(timezone.utc)
+    rows = {d.target: d for d in sub.deliveries}
+    for url, (ok, message) in results.items():
+        d = rows.get(url)
+        if d is None:
+            d = Delivery(target=url, attempts=0)
+            sub.deliveries.append(d)
+        d.attempts += 1
+        d.updated_at = now
+        if ok:
+            d.status = Delivery.STATUS_DELIVERED
+            d.delivered_at = now
+            d.last_error = ''
+        else:
+            d.status = Delivery.STATUS_FAILED
+            d.last_error = message
+
+
+def incomplete(urls, submission_id=None):
+    """
+    Approved submissions missing from at least one of `urls`, oldest first:
+    failed there, or the server was added to the config after approval.
+    """
+    q = Submission.query.filter(
+        Submission.status == Submission.STATUS_APPROVED,
+        db.or_(*[~Submission.deliveries.any(db.and_(Delivery.target == u,
+                                                    Delivery.status == Delivery.STATUS_DELIVERED))
+                 for u in urls]))
+    if submission_id is not None:
+        q = q.filter(Submission.id == submission_id)
+    return q.order_by(Submission.id).all()
+
+
+def backfill_legacy(url):
+    """
+    Record submissions approved before deliveries were tracked as delivered
+    to `url` (TAIKO_SERVER_URL, the only server back then), so they aren't
+    uploaded there again. Returns how many were backfilled (no commit).
+    """
+    url = (url or '').strip()
+    if not url:
+        return 0
+    at = db.func.coalesce(Submission.reviewed_at, Submission.created_at)
+    legacy = db.select(Submission.id, db.literal(url), db.literal(Delivery.STATUS_DELIVERED),
+                       db.literal(1), db.literal(''), at, at) \
+        .where(Submission.status == Submission.STATUS_APPROVED, ~Submission.deliveries.any())
+    result = db.session.execute(
+        db.insert(Delivery).from_select(['submission_id', 'target', 'status', 'attempts',
+                                         'last_error', 'updated_at', 'delivered_at'], legacy))
+    return result.rowcount
@@ -0,0 +1,341 @@
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
+
+from models import db, Submission, SubmissionRank
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no slots
+    fcntl = None
+
+# ─── Bulk export of approved charts for mirrors ──────────────────────────────
+#
+# Streams a zip or tar of approved submissions laid out the way the ESE
+# uploader reads them:
+#
+#     <song_type>/<title>/<title>.tja
+#     <song_type>/<title>/<title>.ogg
+#     manifest.json
+#
+# Archives are produced chunk by chunk from storage.open(): nothing is
+# buffered beyond one CHUNK_SIZE read and nothing touches a temp file.
+#
+# Incremental exports: the manifest's "until" is the next request's
+# "since". Submissions are selected by SubmissionRank.approved_at, which
+# publish() stamps after the remote upload in the same transaction, and
+# "until" trails the clock by SETTLE_SECONDS so a review that is still
+# committing is picked up next time rather than skipped.
+#
+# Paging: with a limit, "until" is moved back to the approved_at of the
+# limit-th submission and the manifest says "more": true. Every export
+# then fits in a gunicorn worker's --timeout, and a mirror just keeps
+# asking with since=until until "more" is false. Submissions sharing that
+# approved_at all go in the same page, so none falls between two pages.
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 200
+SETTLE_SECONDS = 60
+FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+_UNSAFE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def safe_component(name, fallback):
+    """A path component that is valid on Windows and POSIX."""
+    name = _UNSAFE.sub('_', (name or '').strip()).rstrip(' .')[:100]
+    return name or fallback
+
+
+def parse_since(value):
+    """ISO 8601 or Unix time -> naive UTC datetime; None for empty. Raises ValueError."""
+    if not value:
+        return None
+    value = value.strip()
+    if re.fullmatch(r'\d+(\.\d+)?', value):
+        return datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _iso(dt):
+    return dt.isoformat() + 'Z' if dt else None
+
+
+def export_window(since=None, now=None):
+    """(since, until) for an export started at `now`."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return since, now - timedelta(seconds=SETTLE_SECONDS)
+
+
+def _in_window(q, since, until):
+    q = q.filter(SubmissionRank.approved_at <= until)
+    if since is not None:
+        q = q.filter(SubmissionRank.approved_at > since)
+    return q
+
+
+def page_window(since, until, limit):
+    """
+    (until, more) for an export of at most about `limit` submissions:
+    `until` moves back to the limit-th submission's approved_at.
+    """
+    q = _in_window(db.session.query(SubmissionRank.approved_at), since, until)
+    row = q.order_by(SubmissionRank.approved_at, SubmissionRank.submission_id) \
+        .offset(limit - 1).limit(1).first()
+    if row is None:
+        return until, False
+    more = db.session.query(q.filter(SubmissionRank.approved_at > row[0]).exists()).scalar()
+    return (row[0], True) if more else (until, False)
+
+
+def iter_submissions(since, until, batch_size=BATCH_SIZE):
+    """
+    (submission, owns_title) for approved submissions with
+    since < approved_at <= until, oldest first.
+    """
+    last = None
+    while True:
+        q = _in_window(Submission.query.join(Submission.rank), since, until) \
+            .options(contains_eager(Submission.rank), joinedload(Submission.author))
+        if last is not None:
+            q = q.filter(or_(SubmissionRank.approved_at > last[0],
+                             and_(SubmissionRank.approved_at == last[0],
+                                  SubmissionRank.submission_id > last[1])))
+        batch = q.order_by(SubmissionRank.approved_at, SubmissionRank.submission_id) \
+            .limit(batch_size).all()
+        if not batch:
+            return
+        owners = _title_owners(batch)
+        for sub in batch:
+            yield sub, owners.get(_dir_key(sub.song_type, sub.title, sub.id)) == sub.id
+        last = (batch[-1].rank.approved_at, batch[-1].id)
+        # Nothing is modified; don't let identity map grow across batches.
+        db.session.expunge_all()
+
+
+def _dir_key(song_type, title, sid):
+    """The (song_type, title) directory a submission exports to, case-folded."""
+    return (safe_component(song_type, 'Unsorted').lower(),
+            safe_component(title, str(sid)).lower())
+
+
+def _title_owners(batch):
+    """
+    The first approved submission (by approved_at, then id; the export
+    order) per directory key in `batch`. Only that submission gets the
+    bare title as its directory: a title's owner is exported before anyone
+    reusing it and never changes afterwards, so names stay the same from
+    one incremental export to the next.
+
+    Keys are compared after sanitizing, so titles differing only in case
+    or unsafe characters share one owner. That can't be matched in SQL;
+    the approved titles up to the batch's end are scanned instead.
+    """
+    wanted = {_dir_key(sub.song_type, sub.title, sub.id) for sub in batch}
+    rows = db.session.query(Submission.song_type, Submission.title, Submission.id) \
+        .join(Submission.rank) \
+        .filter(Submission.status == Submission.STATUS_APPROVED,
+                SubmissionRank.approved_at <= batch[-1].rank.approved_at) \
+        .order_by(SubmissionRank.approved_at, SubmissionRank.submission_id) \
+        .yield_per(1000)
+    owners = {}
+    for song_type, title, sid in rows:
+        key = _dir_key(song_type, title, sid)
+        if key in wanted:
+            owners.setdefault(key, sid)
+    return owners
+
+
+@contextmanager
+def export_slot(db_uri, slots):
+    """
+    Hold one of `slots` export slots shared by every process using the
+    same database; yields False when all are taken. Keeps long exports
+    from tying up every gunicorn worker.
+    """
+    if fcntl is None:
+        yield True
+        return
+    digest = hashlib.sha1(db_uri.encode('utf-8')).hexdigest()[:12]
+    for n in range(slots):
+        path = os.path.join(tempfile.gettempdir(), f'taiko-export-{digest}-{n}.lock')
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        return
+    yield False
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, non-seekable buffer drained by the streaming generators."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class Exporter:
+    """One export run: walks the submissions and builds the manifest as it goes."""
+
+    def __init__(self, storage, since=None, until=None, limit=None):
+        self.storage = storage
+        self.since, self.until = export_window(since) if until is None else (since, until)
+        self.more = False
+        if limit is not None:
+            self.until, self.more = page_window(self.since, self.until, limit)
+        self.songs = []
+        self.missing = []
+        self._dirs = set()
+
+    def entries(self):
+        """Yield (arcname, stored filename, size, mtime, submission id) for each file."""
+        for sub, owns_title in iter_submissions(self.since, self.until):
+            song_type = safe_component(sub.song_type, 'Unsorted')
+            title = safe_component(sub.title, str(sub.id))
+            # Later submissions reusing a title (or one that sanitizes to
+            # the same name) get their id appended.
+            if not owns_title or (song_type.lower(), title.lower()) in self._dirs:
+                title = f'{title} ({sub.id})'
+            try:
+                sizes = [self.storage.size(sub.id, sub.tja_filename),
+                         self.storage.size(sub.id, sub.ogg_filename)]
+            except FileNotFoundError:
+                self.missing.append(sub.id)
+                continue
+            self._dirs.add((song_type.lower(), title.lower()))
+            directory = f'{song_type}/{title}'
+            files = {
+                'tja': (f'{directory}/{title}.tja', sub.tja_filename, sizes[0]),
+                'ogg': (f'{directory}/{title}.ogg', sub.ogg_filename, sizes[1]),
+            }
+            approved_at = sub.rank.approved_at
+            self.songs.append({
+                'id': sub.id,
+                'song_type': sub.song_type,
+                'title': sub.title,
+                'artist': sub.artist,
+                'author': sub.author.username,
+                'approved_at': _iso(approved_at),
+                'dir': directory,
+                'files': {k: {'path': v[0], 'size': v[2]} for k, v in files.items()},
+            })
+            mtime = approved_at.replace(tzinfo=timezone.utc).timestamp()
+            for arcname, stored, size in files.values():
+                yield arcname, stored, size, mtime, sub.id
+
+    def manifest(self):
+        return {
+            'format': 1,
+            'since': _iso(self.since),
+            'until': _iso(self.until),
+            'more': self.more,
+            'count': len(self.songs),
+            'songs': self.songs,
+            'missing': self.missing,
+        }
+
+    def manifest_bytes(self):
+        return json.dumps(self.manifest(), ensure_ascii=False, indent=1).encode('utf-8')
+
+    def _chunks(self, sid, stored):
+        with closing(self.storage.open(sid, stored)) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    # ── Archive writers ─────────────────────────────────────────────────
+
+    def stream(self, fmt):
+        if fmt == 'zip':
+            return self.stream_zip()
+        if fmt == 'tar':
+            return self.stream_tar()
+        raise ValueError(fmt)
+
+    def stream_zip(self):
+        sink = _Sink()
+        # The sink can't seek, so zipfile writes sizes/CRCs in data descriptors.
+        with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+            for arcname, stored, size, mtime, sid in self.entries():
+                info = zipfile.ZipInfo(arcname, time.gmtime(mtime)[:6])
+                # OGG doesn't compress; TJA is text and shrinks a lot.
+                info.compress_type = zipfile.ZIP_DEFLATED if arcname.endswith('.tja') \
+                    else zipfile.ZIP_STORED
+                info.file_size = size
+                with zf.open(info, 'w', force_zip64=size > 0x7FFFFFFF) as dest:
+                    for chunk in self._chunks(sid, stored):
+                        dest.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+            info = zipfile.ZipInfo('manifest.json', time.gmtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, self.manifest_bytes())
+        yield sink.drain()
+
+    def stream_tar(self):
+        # Headers are built by tarfile; bodies are copied chunk by chunk, so
+        # a 50 MB OGG is never held in memory.
+        for arcname, stored, size, mtime, sid in self.entries():
+            yield self._tar_header(arcname, size, mtime)
+            for chunk in self._chunks(sid, stored):
+                yield chunk
+            yield self._tar_padding(size)
+        body = self.manifest_bytes()
+        yield self._tar_header('manifest.json', len(body), time.time())
+        yield body + self._tar_padding(len(body))
+        yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+    @staticmethod
+    def _tar_header(name, size, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='strict')
+
+    @staticmethod
+    def _tar_padding(size):
+        return b'\0' * (-size % tarfile.BLOCKSIZE)
@@ -0,0 +1,195 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# ─── Structured logging through a background writer ─────────────────────────
+#
+# Logging calls never touch stdout/stderr/files themselves: the record is put
+# on a bounded queue and a QueueListener thread formats and writes it, so a
+# slow journald or a full pipe delays the writer thread, not the request or
+# the upload loop. If the writer falls QUEUE_SIZE records behind, new records
+# are dropped and counted (reported as `dropped` on the next record written)
+# instead of making the caller wait.
+#
+# JsonFormatter writes one object per line:
+#     {"ts": "...", "level": "INFO", "logger": "taiko.request", "msg": "...",
+#      "request_id": "...", "endpoint": "...", "submission_id": 12, ...}
+# with every `extra=` field included. Used by the web app (init_app) and by
+# 谱面本地上传工具.py; only init_app needs Flask.
+
+QUEUE_SIZE = 10000
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+_STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+_REQUEST_ID = re.compile(r'^[\w.-]{1,64}$')
+_pipelines = []
+_app_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when full."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve what depends on the caller's state (args, traceback) here;
+        # formatting is left to the writer thread's handlers.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Pipeline:
+    def __init__(self, handler, targets):
+        self.handler = handler
+        self.targets = targets
+        self.listener = None
+
+    def start(self):
+        self.listener = QueueListener(self.handler.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            try:
+                self.listener.stop()  # drains what is queued
+            except queue.Full:
+                pass
+            self.listener = None
+        for h in self.targets:
+            h.flush()
+
+    def after_fork(self):
+        # The parent's writer thread doesn't exist in the child (gunicorn
+        # --preload); start our own on a fresh queue.
+        self.handler.queue = queue.Queue(self.handler.queue.maxsize)
+        self.start()
+
+
+def start(handlers, logger=None, level=logging.INFO, queue_size=QUEUE_SIZE):
+    """
+    Send `logger`'s records (root by default) to `handlers` through a
+    background writer thread. Returns the QueueHandler added to `logger`.
+    """
+    logger = logging.getLogger() if logger is None else logger
+    qh = _NonBlockingQueueHandler(queue.Queue(queue_size))
+    logger.addHandler(qh)
+    logger.setLevel(level)
+    pipeline = _Pipeline(qh, list(handlers))
+    pipeline.start()
+    _pipelines.append(pipeline)
+    return qh
+
+
+def stop():
+    """Write out everything still queued; runs at exit."""
+    for p in _pipelines:
+        p.stop()
+
+
+def _after_fork():
+    for p in _pipelines:
+        p.after_fork()
+
+
+atexit.register(stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def init_app(app):
+    """
+    Log the web app as JSON to stderr (journald under systemd), one
+    `taiko.request` record per request, with request id, endpoint, timing
+    and submission id attached to every record logged during a request.
+    """
+    global _app_handler
+    from flask import g, has_request_context, request
+    from flask.logging import default_handler
+
+    app.logger.removeHandler(default_handler)
+    if _app_handler is None:  # once per process, however many apps are built
+        stream = logging.StreamHandler(sys.stderr)
+        if app.config.get('LOG_FORMAT', 'json') == 'json':
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+        _app_handler = start([stream], level=app.config.get('LOG_LEVEL', 'INFO'),
+                              queue_size=app.config.get('LOG_QUEUE_SIZE', QUEUE_SIZE))
+
+        def add_request_fields(record):
+            if has_request_context():
+                record.request_id = g.get('request_id')
+                record.endpoint = request.endpoint
+                record.method = request.method
+                record.path = request.path
+                if getattr(record, 'submission_id', None) is None and request.view_args:
+                    record.submission_id = request.view_args.get('sid')
+                user = g.get('_login_user')  # only if Flask-Login already loaded it
+                if user is not None and getattr(user, 'id', None) is not None:
+                    record.user_id = user.id
+            return True
+
+        _app_handler.addFilter(add_request_fields)
+
+    access = logging.getLogger('taiko.request')
+
+    @app.before_request
+    def _log_start():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex[:16]
+        g._log_start = time.perf_counter()
+
+    @app.after_request
+    def _log_request(response):
+        start_time = g.pop('_log_start', None)
+        if start_time is not None:
+            access.info('%s %s %s', request.method, request.full_path.rstrip('?'),
+                        response.status_code, extra={
+                            'status': response.status_code,
+                            'duration_ms': round((time.perf_counter() - start_time) * 1000, 1),
+                        })
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
@@ -0,0 +1,384 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: single process, no lock needed
+    fcntl = None
+
+# ─── Prometheus-style metrics shared across gunicorn workers ─────────────────
+#
+# Each process keeps its own counters/histograms in memory and a background
+# thread writes them to METRICS_DIR/<pid>-<start>.json once a second, so
+# requests never wait on the disk. A scrape merges every file
+# in the directory, so /metrics reports the whole service no matter which
+# worker answers it. Gauges are computed by the scraping process only.
+#
+# Workers replaced by a reload (HUP) or recycled by gunicorn leave their
+# file behind. A scrape folds the files of processes that no longer exist
+# into ARCHIVE and deletes them, so counters keep counting across reloads
+# while the directory holds one file per live process plus the archive.
+
+ARCHIVE = 'archive.json'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UPLOAD_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _label_key(labelnames, labels):
+    return json.dumps([str(labels.get(n, '')) for n in labelnames])
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.registry.dirty = True
+
+    def dump(self):
+        return dict(self.values)
+
+    @staticmethod
+    def merge(into, values):
+        for key, v in values.items():
+            into[key] = into.get(key, 0) + v
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, then sum and count.
+                entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+            self.registry.dirty = True
+
+    def dump(self):
+        return {k: list(v) for k, v in self.values.items()}
+
+    @staticmethod
+    def merge(into, values):
+        for key, v in values.items():
+            cur = into.get(key)
+            if cur is None:
+                into[key] = list(v)
+            else:
+                for i, x in enumerate(v):
+                    cur[i] += x
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.gauges = {}
+        self.dirty = False
+        self.directory = None
+        self.flush_interval = 1.0
+        self._path = None
+        self._flusher_pid = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def counter(self, name, help_text, labelnames=()):
+        m = self.metrics[name] = Counter(self, name, help_text, labelnames)
+        return m
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        m = self.metrics[name] = Histogram(self, name, help_text, labelnames, buckets)
+        return m
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value `fn()` is read at scrape time."""
+        self.gauges[name] = (help_text, fn)
+
+    # ── Persistence ─────────────────────────────────────────────────────
+
+    def _after_fork(self):
+        # Forked (e.g. gunicorn --preload): the parent's counts stay in its
+        # own file, so start from zero with a file of our own.
+        self.lock = threading.Lock()
+        for m in self.metrics.values():
+            m.values.clear()
+        self.dirty = False
+        self._path = None
+        self._flusher_pid = None
+
+    def ensure_flusher(self):
+        """Start this process's background flush thread if it isn't running."""
+        if self.directory is None or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _own_path(self):
+        if self._path is None:
+            name = f'{os.getpid()}-{int(time.time() * 1000)}.json'
+            self._path = os.path.join(self.directory, name)
+        return self._path
+
+    def flush(self, force=False):
+        if self.directory is None or not (force or self.dirty):
+            return
+        path = self._own_path()
+        with self.lock:
+            data = {name: m.dump() for name, m in self.metrics.items()}
+            self.dirty = False
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Merge the values of every process that has written a file."""
+        self.flush(force=True)
+        merged = {name: {} for name in self.metrics}
+        if self.directory is None:
+            for name, m in self.metrics.items():
+                m.merge(merged[name], m.dump())
+            return merged
+        with self._dir_lock():
+            if fcntl is not None:  # os.kill(pid, 0) is not a probe on Windows
+                self._prune()
+            for entry in os.listdir(self.directory):
+                if not entry.endswith('.json'):
+                    continue
+                data = self._read(entry)
+                if data is not None:
+                    self._merge(merged, data)
+        return merged
+
+    def _merge(self, merged, data):
+        for name, values in data.items():
+            m = self.metrics.get(name)
+            if m is not None:
+                m.merge(merged.setdefault(name, {}), values)
+
+    def _read(self, entry):
+        try:
+            with open(os.path.join(self.directory, entry), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _dir_lock(self):
+        # Scrapes in different workers must not fold the same file twice.
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _prune(self):
+        """Fold the files of exited processes into ARCHIVE and delete them."""
+        entries = os.listdir(self.directory)
+        dead = [e for e in entries if e.endswith('.json') and not _process_alive(e)]
+        if not dead:
+            return
+        archive = self._read(ARCHIVE) or {}
+        # Files already in the archive whose deletion didn't happen (crash
+        # in between); names no longer on disk are forgotten.
+        folded = set(archive.pop('_folded', ())) & set(entries)
+        values = {}
+        self._merge(values, archive)
+        for entry in dead:
+            if entry not in folded:
+                data = self._read(entry)
+                if data is None:
+                    continue
+                self._merge(values, data)
+                folded.add(entry)
+        values['_folded'] = sorted(folded)
+        path = os.path.join(self.directory, ARCHIVE)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(values, f)
+            os.replace(path + '.tmp', path)
+            for entry in dead:
+                os.unlink(os.path.join(self.directory, entry))
+        except OSError:
+            pass
+
+    # ── Exposition ──────────────────────────────────────────────────────
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        merged = self.collect()
+        lines = []
+        for name, m in self.metrics.items():
+            lines.append(f'# HELP {name} {m.help}')
+            lines.append(f'# TYPE {name} {m.kind}')
+            for key, value in sorted(merged[name].items()):
+                pairs = list(zip(m.labelnames, json.loads(key)))
+                if m.kind == 'counter':
+                    lines.append(f'{name}{self._labels(pairs)} {_fmt(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(m.buckets, value):
+                    cumulative += count
+                    le = self._labels(pairs + [('le', _fmt(bound))])
+                    lines.append(f'{name}_bucket{le} {cumulative}')
+                lines.append(f'{name}_sum{self._labels(pairs)} {_fmt(value[-2])}')
+                lines.append(f'{name}_count{self._labels(pairs)} {_fmt(value[-1])}')
+        for name, (help_text, fn) in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_fmt(value)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _process_alive(entry):
+    """Whether the process that wrote `<pid>-<start>.json` still runs (True for other files)."""
+    pid = entry.split('-', 1)[0]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by someone else
+    return True
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    'taiko_request_duration_seconds', 'Request latency by Flask endpoint.',
+    ('endpoint', 'method'))
+REQUESTS = registry.counter(
+    'taiko_requests_total', 'Requests by Flask endpoint and status code.',
+    ('endpoint', 'method', 'status'))
+DB_QUERY = registry.histogram(
+    'taiko_db_query_duration_seconds', 'SQL statement execution time.',
+    buckets=DB_BUCKETS)
+UPLOAD_BYTES = registry.counter(
+    'taiko_upload_bytes_total', 'Bytes received by the upload view.', ('kind',))
+UPLOAD_DURATION = registry.histogram(
+    'taiko_upload_duration_seconds', 'Time the upload view spent saving a submission.',
+    buckets=UPLOAD_BUCKETS)
+REMOTE_UPLOAD_BYTES = registry.counter(
+    'taiko_remote_upload_bytes_total', 'Bytes sent by upload_to_taiko_server.')
+REMOTE_UPLOAD_DURATION = registry.histogram(
+    'taiko_remote_upload_duration_seconds',
+    'Wall time of upload_to_taiko_server including retries.', buckets=UPLOAD_BUCKETS)
+REMOTE_UPLOADS = registry.counter(
+    'taiko_remote_uploads_total', 'Remote uploads by result.', ('result',))
+STARTUP_DURATION = registry.histogram(
+    'taiko_app_startup_seconds', 'Time create_app() took, once per process that built the app.',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+REMOTE_UPLOAD_RETRIES = registry.counter(
+    'taiko_remote_upload_retries_total', 'Retries made by upload_to_taiko_server.')
+
+
+def init_app(app):
+    """Hook request timing and SQL timing into `app`."""
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        registry.directory = directory
+    atexit.register(registry.flush, True)
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.observe(time.perf_counter() - start,
+                                    endpoint=endpoint, method=request.method)
+            REQUESTS.inc(endpoint=endpoint, method=request.method,
+                         status=response.status_code)
+        registry.ensure_flusher()
+        return response
+
+    with app.app_context():
+        from models import db
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _query_start(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _query_end(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('_metrics_query_start')
+        if stack:
+            DB_QUERY.observe(time.perf_counter() - stack.pop())
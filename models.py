@@ -40,7 +40,7 @@ class Submission(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    title = db.Column(db.String(200), nullable=False)
+    title = db.Column(db.String(200), nullable=False, index=True)
     artist = db.Column(db.String(200), default='')
     tja_filename = db.Column(db.String(300), nullable=False)
     ogg_filename = db.Column(db.String(300), nullable=False)
@@ -49,11 +49,26 @@ class Submission(db.Model):
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     reviewed_at = db.Column(db.DateTime, nullable=True)
     review_note = db.Column(db.Text, default='')
+    # Set when the submission is cancelled or rejected; the sweeper deletes
+    # its files once this is older than SWEEP_RETENTION_DAYS.
+    closed_at = db.Column(db.DateTime, nullable=True, index=True)
+    storage_bytes = db.Column(db.BigInteger, default=0, server_default='0')
+    purged_at = db.Column(db.DateTime, nullable=True)
+    # Probed from the OGG while it was uploaded (see oggprobe.py); NULL for
+    # submissions from before probing until `flask probe-audio` fills them in.
+    audio_duration = db.Column(db.Float, nullable=True)  # seconds
+    audio_sample_rate = db.Column(db.Integer, nullable=True)
+    audio_channels = db.Column(db.Integer, nullable=True)
+    audio_bitrate = db.Column(db.Integer, nullable=True)  # average, bits/s
 
     comments = db.relationship('Comment', backref='submission', lazy='dynamic',
                                cascade='all, delete-orphan')
     likes = db.relationship('Like', backref='submission', lazy='dynamic',
                             cascade='all, delete-orphan')
+    rank = db.relationship('SubmissionRank', uselist=False, lazy='select',
+                           cascade='all, delete-orphan')
+    deliveries = db.relationship('Delivery', backref='submission', lazy='select',
+                                 cascade='all, delete-orphan', order_by='Delivery.target')
 
     @property
     def like_count(self):
@@ -77,6 +92,65 @@ class Submission(db.Model):
         return f'<Submission {self.title}>'
 
 
+class SubmissionRank(db.Model):
+    """
+    Denormalized like/comment counts and hot score of an approved submission,
+    so the community sort modes are plain index scans. Maintained by ranking.py.
+    """
+    __tablename__ = 'submission_ranks'
+
+    submission_id = db.Column(db.Integer, db.ForeignKey('submissions.id'), primary_key=True)
+    like_count = db.Column(db.Integer, nullable=False, default=0)
+    comment_count = db.Column(db.Integer, nullable=False, default=0)
+    hot_score = db.Column(db.Float, nullable=False, default=0.0)
+    approved_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_rank_hot', 'hot_score', 'submission_id'),
+        db.Index('ix_rank_likes', 'like_count', 'submission_id'),
+        db.Index('ix_rank_comments', 'comment_count', 'submission_id'),
+        db.Index('ix_rank_approved', 'approved_at', 'submission_id'),
+    )
+
+    def __repr__(self):
+        return f'<SubmissionRank {self.submission_id}: {self.hot_score:.3f}>'
+
+
+class Delivery(db.Model):
+    """Upload state of an approved submission on one taiko-web server (see delivery.py)."""
+    __tablename__ = 'deliveries'
+
+    STATUS_DELIVERED = 'delivered'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submissions.id'), nullable=False)
+    target = db.Column(db.String(300), nullable=False)
+    status = db.Column(db.String(20), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, default='')
+    updated_at = db.Column(db.DateTime, nullable=False)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('submission_id', 'target', name='unique_submission_target'),
+    )
+
+    def __repr__(self):
+        return f'<Delivery {self.submission_id} -> {self.target}: {self.status}>'
+
+
+class UserUsage(db.Model):
+    """Bytes each user currently has in storage, kept up to date on write/delete."""
+    __tablename__ = 'user_usage'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserUsage {self.user_id}: {self.bytes_used}>'
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
 
@@ -86,6 +160,11 @@ class Comment(db.Model):
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    __table_args__ = (
+        # Serves the (created_at, id) keyset pagination of a submission's comments.
+        db.Index('ix_comments_submission_created', 'submission_id', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Comment by {self.user_id} on {self.submission_id}>'
 
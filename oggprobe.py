@@ -0,0 +1,197 @@
+import struct
+import zlib
+from collections import namedtuple
+
+# ─── Streaming Ogg Vorbis validation ─────────────────────────────────────────
+#
+# OggProbe checks an upload page by page while storage.save() writes it (see
+# ProbingReader), so a truncated or non-Vorbis file is rejected without a
+# second read and long before it is reviewed or sent to taiko-web:
+#
+#   - every page: "OggS" capture, version 0, CRC, consecutive sequence
+#     numbers, continuation flags that match the previous page's lacing,
+#     a single logical stream;
+#   - the first three packets are the Vorbis identification, comment and
+#     setup headers, the identification header alone on the first page;
+#   - granule positions never go backwards, the last page carries the EOS
+#     flag and nothing follows it.
+#
+# From the same pass it derives sample rate, channels, duration (last
+# granule position / sample rate) and average bitrate.
+
+_HEADER = struct.Struct('<4sBBqIIIB')  # capture, version, flags, granule, serial, seq, crc, segments
+FLAG_CONTINUED = 0x01
+FLAG_BOS = 0x02
+FLAG_EOS = 0x04
+_ID_HEADER = struct.Struct('<7sIBIiii')  # "\x01vorbis", version, channels, rate, bitrate max/nominal/min
+
+# Ogg's CRC-32 is MSB-first (poly 0x04C11DB7, init 0, no final xor); zlib's
+# is the bit-reflected form of the same polynomial. Feeding zlib
+# bit-reversed bytes and reversing its result gives Ogg's CRC at C speed.
+_REVERSED = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+
+def _reverse32(value):
+    return int.from_bytes(value.to_bytes(4, 'little').translate(_REVERSED), 'big')
+
+
+def ogg_crc(*parts):
+    """Ogg page CRC of the concatenated byte strings `parts`."""
+    c = 0xFFFFFFFF  # zlib inverts on entry: this starts it from 0
+    for part in parts:
+        c = zlib.crc32(part.translate(_REVERSED), c)
+    return _reverse32(c ^ 0xFFFFFFFF)
+
+
+class OggError(ValueError):
+    """The file is not a well-formed Ogg Vorbis stream; the message is shown to the uploader."""
+
+
+OggInfo = namedtuple('OggInfo', 'duration sample_rate channels bitrate nominal_bitrate')
+
+
+class OggProbe:
+    """Incremental validator: feed() the file in chunks of any size, then finish()."""
+
+    def __init__(self):
+        self.size = 0
+        self.pages = 0
+        self.sample_rate = None
+        self.channels = None
+        self.nominal_bitrate = None
+        self._buf = bytearray()
+        self._serial = None
+        self._seq = None
+        self._granule = 0
+        self._eos = False
+        self._open = False        # last packet continues on the next page
+        self._headers = 0         # Vorbis header packets seen (stops at 3)
+        self._head = bytearray()  # start of the header packet being read
+
+    def feed(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        buf = self._buf
+        buf += data
+        off = 0
+        while len(buf) - off >= _HEADER.size:
+            capture, version, flags, granule, serial, seq, crc, nseg = _HEADER.unpack_from(buf, off)
+            if capture != b'OggS':
+                if self._eos:
+                    raise OggError('结束页之后还有数据')
+                raise OggError('不是 Ogg 文件' if self.pages == 0 else f'第 {self.pages + 1} 页损坏')
+            lacing_end = off + _HEADER.size + nseg
+            if len(buf) < lacing_end:
+                break
+            lacing = buf[off + _HEADER.size:lacing_end]
+            end = lacing_end + sum(lacing)
+            if len(buf) < end:
+                break
+            self._page(buf, off, lacing_end, end, lacing, version, flags, granule, serial, seq, crc)
+            off = end
+        del buf[:off]
+
+    def _page(self, buf, off, body, end, lacing, version, flags, granule, serial, seq, crc):
+        page_no = self.pages + 1
+        if self._eos:
+            raise OggError('结束页之后还有数据（可能是串接的多个音频）')
+        if version != 0:
+            raise OggError(f'第 {page_no} 页版本号无效')
+        if ogg_crc(buf[off:off + 22], b'\0\0\0\0', buf[off + 26:end]) != crc:
+            raise OggError(f'第 {page_no} 页校验失败，文件已损坏')
+        if self._serial is None:
+            if not flags & FLAG_BOS:
+                raise OggError('缺少起始页')
+            self._serial = serial
+        elif serial != self._serial or flags & FLAG_BOS:
+            raise OggError('包含多个音频流，不支持')
+        elif seq != (self._seq + 1) & 0xFFFFFFFF:
+            raise OggError(f'第 {page_no} 页之前缺页，文件不完整')
+        if bool(flags & FLAG_CONTINUED) != self._open:
+            raise OggError(f'第 {page_no} 页数据包不连续')
+        self._seq = seq
+        self.pages = page_no
+
+        if self._headers < 3:
+            self._read_headers(buf, body, lacing)
+            if page_no == 1 and (self._headers != 1 or lacing[-1] == 255):
+                raise OggError('第一页应只包含 Vorbis 标识头')
+        if lacing:
+            self._open = lacing[-1] == 255
+        if granule != -1:
+            if granule < self._granule:
+                raise OggError(f'第 {page_no} 页时间位置倒退')
+            self._granule = granule
+        if flags & FLAG_EOS:
+            self._eos = True
+
+    def _read_headers(self, buf, pos, lacing):
+        for value in lacing:
+            if len(self._head) < _ID_HEADER.size:
+                self._head += buf[pos:pos + min(value, _ID_HEADER.size - len(self._head))]
+            pos += value
+            if value < 255:
+                self._header_packet(bytes(self._head))
+                self._head.clear()
+                if self._headers == 3:
+                    return
+
+    def _header_packet(self, head):
+        n = self._headers
+        if n == 0:
+            if head.startswith(b'OpusHead'):
+                raise OggError('Opus 编码的 OGG 不受支持，请转为 Vorbis 编码')
+            if not head.startswith(b'\x01vorbis'):
+                raise OggError('不是 Vorbis 编码的 OGG 音频')
+            if len(head) < _ID_HEADER.size:
+                raise OggError('Vorbis 标识头不完整')
+            _, version, channels, rate, _, nominal, _ = _ID_HEADER.unpack_from(head)
+            if version != 0 or not channels or not rate:
+                raise OggError('Vorbis 标识头无效')
+            self.channels, self.sample_rate = channels, rate
+            self.nominal_bitrate = nominal if nominal > 0 else None
+        elif not head.startswith(b'\x03vorbis' if n == 1 else b'\x05vorbis'):
+            raise OggError('Vorbis 注释头或配置头缺失')
+        self._headers = n + 1
+
+    def finish(self):
+        """Check the end of the stream and return an OggInfo; raises OggError."""
+        if self.pages == 0:
+            if len(self._buf) >= _HEADER.size:  # capture already checked by feed()
+                raise OggError('文件不完整（第一页被截断）')
+            raise OggError('不是 Ogg 文件')
+        if self._buf:
+            raise OggError('结束页之后还有数据' if self._eos else '文件不完整（最后一页被截断）')
+        if self._headers < 3:
+            raise OggError('Vorbis 头不完整')
+        if not self._eos:
+            raise OggError('文件不完整（缺少结束页）')
+        if self._granule <= 0:
+            raise OggError('音频没有内容')
+        duration = self._granule / self.sample_rate
+        return OggInfo(duration=duration, sample_rate=self.sample_rate, channels=self.channels,
+                       bitrate=int(self.size * 8 / duration), nominal_bitrate=self.nominal_bitrate)
+
+
+class ProbingReader:
+    """File-like wrapper that feeds everything read through it to an OggProbe."""
+
+    def __init__(self, stream, probe=None):
+        self.stream = stream
+        self.probe = probe or OggProbe()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.probe.feed(data)
+        return data
+
+
+def probe_file(stream, chunk_size=64 * 1024):
+    """Validate a whole file object; return its OggInfo or raise OggError."""
+    p = OggProbe()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return p.finish()
+        p.feed(chunk)
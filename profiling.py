@@ -0,0 +1,214 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import random
+import re
+import secrets
+import time
+from datetime import datetime, timezone
+
+from flask import g, request
+
+# ─── On-demand request profiling ─────────────────────────────────────────────
+#
+# Off unless asked for. A request runs under cProfile when either
+#   - it wins the sampling draw (rate set on the admin page, default
+#     PROFILE_SAMPLE_RATE), or
+#   - it comes from an admin and carries the header `X-Taiko-Profile: 1`.
+#
+# Each capture is written to PROFILE_DIR as <name>.prof (pstats format; opens
+# in snakeviz / gprof2dot) plus <name>.json with the request's metadata. Only
+# the newest PROFILE_KEEP captures are kept.
+#
+# The sampling rate lives in PROFILE_DIR/settings.json so every gunicorn
+# worker picks up a change within SETTINGS_TTL seconds. With the rate at 0
+# a request costs one clock comparison and one header lookup; with
+# PROFILE_DIR empty no hook is installed at all.
+
+HEADER = 'X-Taiko-Profile'
+SETTINGS_TTL = 5.0
+_NAME = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+
+
+class Profiler:
+    def __init__(self, directory, keep=200, rate=0.0):
+        self.directory = directory
+        self.keep = keep
+        self.default_rate = rate
+        self.rate = rate
+        self._settings = os.path.join(directory, 'settings.json')
+        self._next_check = 0.0
+        self._mtime = None
+
+    # ── Sampling rate ───────────────────────────────────────────────────
+
+    def current_rate(self):
+        """Sampling rate, re-read from settings.json at most every SETTINGS_TTL."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + SETTINGS_TTL
+            self._reload()
+        return self.rate
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self._settings).st_mtime
+        except OSError:
+            self.rate, self._mtime = self.default_rate, None
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self._settings, 'r', encoding='utf-8') as f:
+                rate = float(json.load(f)['rate'])
+            if math.isfinite(rate):  # json.load accepts NaN
+                self.rate = rate
+            self._mtime = mtime
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def set_rate(self, rate):
+        """Change the sampling rate for every worker; raises ValueError unless finite."""
+        rate = float(rate)
+        if not math.isfinite(rate):
+            raise ValueError(f'invalid sampling rate: {rate}')
+        rate = min(max(rate, 0.0), 1.0)
+        tmp = self._settings + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'rate': rate}, f)
+        os.replace(tmp, self._settings)
+        self.rate = rate
+        self._next_check = 0.0
+        return rate
+
+    # ── Captures ────────────────────────────────────────────────────────
+
+    def save(self, prof, meta):
+        """Write one capture and drop the oldest beyond `keep`; return its name."""
+        name = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-') + secrets.token_hex(3)
+        prof.dump_stats(os.path.join(self.directory, name + '.prof'))
+        meta = dict(meta, name=name)
+        with open(os.path.join(self.directory, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._rotate()
+        return name
+
+    def _names(self):
+        return sorted(e[:-5] for e in os.listdir(self.directory)
+                      if e.endswith('.json') and _NAME.match(e[:-5]))
+
+    def _rotate(self):
+        names = self._names()
+        for name in names[:max(len(names) - self.keep, 0)]:
+            for ext in ('.json', '.prof'):
+                try:
+                    os.unlink(os.path.join(self.directory, name + ext))
+                except OSError:
+                    pass
+
+    def captures(self):
+        """Metadata of every capture on disk, newest first."""
+        out = []
+        for name in reversed(self._names()):
+            try:
+                with open(os.path.join(self.directory, name + '.json'), 'r', encoding='utf-8') as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def slowest_by_endpoint(self, per_endpoint=5):
+        """[(endpoint, capture count, slowest captures)], slowest endpoint first."""
+        groups = {}
+        for c in self.captures():
+            groups.setdefault(c['endpoint'], []).append(c)
+        rows = []
+        for endpoint, items in groups.items():
+            items.sort(key=lambda c: c['duration_ms'], reverse=True)
+            rows.append((endpoint, len(items), items[:per_endpoint]))
+        rows.sort(key=lambda r: r[2][0]['duration_ms'], reverse=True)
+        return rows
+
+    def path(self, name):
+        """Path of a capture's .prof file; raises FileNotFoundError."""
+        p = os.path.join(self.directory, name + '.prof')
+        if not _NAME.match(name) or not os.path.isfile(p):
+            raise FileNotFoundError(name)
+        return p
+
+    def meta(self, name):
+        self.path(name)
+        with open(os.path.join(self.directory, name + '.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def report(self, name, sort='cumulative', limit=60):
+        """pstats text of a capture, top `limit` functions by `sort`."""
+        out = io.StringIO()
+        stats = pstats.Stats(self.path(name), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def init_app(app, is_admin):
+    """
+    Install the profiling hooks on `app` unless PROFILE_DIR is empty.
+    `is_admin()` is only called for requests that carry the header.
+    """
+    directory = app.config.get('PROFILE_DIR')
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    profiler = Profiler(directory, keep=app.config.get('PROFILE_KEEP', 200),
+                        rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0))
+
+    @app.before_request
+    def _profile_start():
+        forced = request.headers.get(HEADER) == '1' and is_admin()
+        if not forced:
+            rate = profiler.current_rate()
+            if not rate or random.random() >= rate:
+                return
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            return  # another profiler is active in this thread
+        g._profile = (prof, time.perf_counter(), forced)
+
+    @app.after_request
+    def _profile_stop(response):
+        entry = g.pop('_profile', None)
+        if entry is None:
+            return response
+        prof, start, forced = entry
+        prof.disable()
+        duration = time.perf_counter() - start
+        try:
+            name = profiler.save(prof, {
+                'endpoint': request.endpoint or 'unmatched',
+                'method': request.method,
+                'path': request.full_path.rstrip('?'),
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 1),
+                'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'pid': os.getpid(),
+                'trigger': 'header' if forced else 'sample',
+            })
+        except OSError:
+            return response
+        if forced:
+            response.headers[HEADER] = name
+        return response
+
+    @app.teardown_request
+    def _profile_cleanup(exc):
+        # after_request didn't run (e.g. the response failed to build).
+        entry = g.pop('_profile', None)
+        if entry is not None:
+            entry[0].disable()
+
+    app.extensions['profiler'] = profiler
+    return profiler
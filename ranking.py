@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import func, insert, update
+
+from models import db, Submission, SubmissionRank, Comment, Like
+
+# ─── Community ranking ───────────────────────────────────────────────────────
+#
+# submission_ranks keeps one row per approved submission with its like and
+# comment counts and a "hot" score, so every community sort mode is an
+# ORDER BY over an index with LIMIT/OFFSET, the same cost as the newest-first
+# listing. toggle_like / add_comment / admin_review adjust the row in the same
+# transaction as their own change.
+#
+# The hot score decays with age (Hacker News style):
+#     (likes + COMMENT_WEIGHT * comments) / (age_hours + 2) ** GRAVITY
+# Because age keeps growing, `flask rank-decay` recomputes every score in
+# batches on a timer; rows touched in between are recomputed immediately.
+
+COMMENT_WEIGHT = 2.0
+GRAVITY = 1.5
+BATCH_SIZE = 1000
+
+
+def _utc_naive(dt):
+    # SQLite hands back naive datetimes that are really UTC.
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def hot_score(likes, comments, approved_at, now=None):
+    now = _utc_naive(now or datetime.now(timezone.utc))
+    age_hours = max(0.0, (now - _utc_naive(approved_at)).total_seconds() / 3600)
+    return (likes + COMMENT_WEIGHT * comments) / (age_hours + 2) ** GRAVITY
+
+
+def publish(sub):
+    """Create (or refresh) the rank row of a freshly approved submission."""
+    likes = Like.query.filter_by(submission_id=sub.id).count()
+    comments = Comment.query.filter_by(submission_id=sub.id).count()
+    # Stamped after the remote upload, just before commit: export.py relies
+    # on approved_at being (nearly) the commit time.
+    approved_at = _utc_naive(datetime.now(timezone.utc))
+    rank = db.session.get(SubmissionRank, sub.id)
+    if rank is None:
+        rank = SubmissionRank(submission_id=sub.id)
+        db.session.add(rank)
+    rank.like_count = likes
+    rank.comment_count = comments
+    rank.approved_at = approved_at
+    rank.hot_score = hot_score(likes, comments, approved_at)
+    return rank
+
+
+def bump(submission_id, likes=0, comments=0):
+    """
+    Adjust a submission's counters atomically (safe across workers) and
+    refresh its hot score. Returns the rank row, or None if it has none.
+    """
+    db.session.execute(
+        update(SubmissionRank)
+        .where(SubmissionRank.submission_id == submission_id)
+        .values(like_count=SubmissionRank.like_count + likes,
+                comment_count=SubmissionRank.comment_count + comments)
+        .execution_options(synchronize_session=False))
+    rank = db.session.get(SubmissionRank, submission_id, populate_existing=True)
+    if rank is not None:
+        rank.hot_score = hot_score(rank.like_count, rank.comment_count, rank.approved_at)
+    return rank
+
+
+def decay(now=None, batch_size=BATCH_SIZE, log=print):
+    """Recompute every hot score for the current time. Returns rows updated."""
+    now = now or datetime.now(timezone.utc)
+    done = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(SubmissionRank.submission_id, SubmissionRank.like_count,
+                                SubmissionRank.comment_count, SubmissionRank.approved_at) \
+            .filter(SubmissionRank.submission_id > last_id) \
+            .order_by(SubmissionRank.submission_id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(update(SubmissionRank), [
+            {'submission_id': sid, 'hot_score': hot_score(likes, comments, approved_at, now)}
+            for sid, likes, comments, approved_at in rows
+        ])
+        db.session.commit()
+        done += len(rows)
+        last_id = rows[-1][0]
+    log(f'已重算 {done} 个投稿的热度')
+    return done
+
+
+def rebuild(batch_size=BATCH_SIZE, log=print):
+    """Recount everything from likes/comments (first deploy, or to fix drift)."""
+    like_counts = dict(db.session.query(Like.submission_id, func.count())
+                       .group_by(Like.submission_id).all())
+    comment_counts = dict(db.session.query(Comment.submission_id, func.count())
+                          .group_by(Comment.submission_id).all())
+    SubmissionRank.query.delete()
+    now = datetime.now(timezone.utc)
+    done = 0
+    last_id = 0
+    # One transaction, so the community page never sees a half-built table.
+    while True:
+        subs = db.session.query(Submission.id, Submission.reviewed_at, Submission.created_at) \
+            .filter(Submission.status == Submission.STATUS_APPROVED, Submission.id > last_id) \
+            .order_by(Submission.id).limit(batch_size).all()
+        if not subs:
+            break
+        rows = []
+        for sid, reviewed_at, created_at in subs:
+            approved_at = _utc_naive(reviewed_at or created_at or now)
+            likes = like_counts.get(sid, 0)
+            comments = comment_counts.get(sid, 0)
+            rows.append({'submission_id': sid, 'like_count': likes, 'comment_count': comments,
+                         'approved_at': approved_at,
+                         'hot_score': hot_score(likes, comments, approved_at, now)})
+        db.session.execute(insert(SubmissionRank), rows)
+        done += len(subs)
+        last_id = subs[-1][0]
+    db.session.commit()
+    log(f'已重建 {done} 个投稿的排行数据')
+    return done
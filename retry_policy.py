@@ -0,0 +1,329 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+# ─── Retry policy for calls to taiko-web servers ─────────────────────────────
+#
+# Shared by utils.upload_to_taiko_server (web app) and the ESE CLI uploader.
+# Backoff is exponential with full jitter, Retry-After is honoured, and a
+# per-host circuit breaker makes a dead server fail fast instead of costing
+# every song a timeout plus sleep.
+
+NETWORK_ERRORS = (
+    requests.exceptions.ProxyError,
+    requests.exceptions.ConnectTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# Statuses that say "not processed, try again later" for any method.
+RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
+# A plain 500 may have half-applied a POST, so only idempotent calls retry it.
+IDEMPOTENT_RETRYABLE_STATUSES = RETRYABLE_STATUSES | {500}
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class CircuitOpenError(Exception):
+    """Raised when a host's breaker is open and the call was not attempted."""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f'{host} 熔断中，{retry_in:.0f} 秒后再试')
+        self.host = host
+        self.retry_in = retry_in
+
+
+class RetryPolicy:
+    """
+    How many times to try, and how long to wait in between.
+    `budget` (seconds, None = unlimited) bounds the whole request: no retry
+    is started if its wait would end past it. Callers running inside a web
+    worker set it well below the worker timeout.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=60.0,
+                 max_retry_after=120.0, breaker_threshold=3, breaker_reset=60.0,
+                 budget=None, rng=None):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.max_retry_after = float(max_retry_after)
+        self.budget = float(budget) if budget else None
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self._rng = rng or random.Random()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            max_attempts=config.get('UPLOAD_MAX_ATTEMPTS', 4),
+            base_delay=config.get('UPLOAD_BACKOFF_BASE', 2.0),
+            max_delay=config.get('UPLOAD_BACKOFF_MAX', 60.0),
+            max_retry_after=config.get('UPLOAD_RETRY_AFTER_MAX', 120.0),
+            budget=config.get('UPLOAD_RETRY_BUDGET'),
+            breaker_threshold=config.get('UPLOAD_BREAKER_THRESHOLD', 3),
+            breaker_reset=config.get('UPLOAD_BREAKER_RESET', 60.0),
+        )
+
+    def as_dict(self):
+        return {
+            'max_attempts': self.max_attempts,
+            'base_delay': self.base_delay,
+            'max_delay': self.max_delay,
+            'max_retry_after': self.max_retry_after,
+            'budget': self.budget,
+            'breaker_threshold': self.breaker_threshold,
+            'breaker_reset': self.breaker_reset,
+        }
+
+    def is_retryable(self, method, status_code):
+        if method.upper() in IDEMPOTENT_METHODS:
+            return status_code in IDEMPOTENT_RETRYABLE_STATUSES
+        return status_code in RETRYABLE_STATUSES
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff after the given (1-based) attempt."""
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return self._rng.uniform(0, cap)
+
+    def delay_for(self, attempt, response=None):
+        """Seconds to wait before the next attempt, honouring Retry-After."""
+        delay = self.backoff(attempt)
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) \
+            if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+# ─── Circuit breaker ─────────────────────────────────────────────────────────
+
+class CircuitBreaker:
+    """
+    Classic closed → open → half-open breaker for one host.
+    After `failure_threshold` consecutive failures the breaker opens and
+    calls fail fast for `reset_timeout` seconds; then a single trial call
+    is let through and its result closes or re-opens the breaker.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host, failure_threshold=3, reset_timeout=60.0, clock=time.monotonic):
+        self.host = host
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.total_failures = 0
+        self.total_successes = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self):
+        """Return True if a call may be made now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """Seconds until an open breaker lets a trial call through."""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.total_successes += 1
+            self._failures = 0
+            self._state = self.CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.total_failures += 1
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._trial_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'host': self.host,
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'total_failures': self.total_failures,
+                'total_successes': self.total_successes,
+                'rejected': self.rejected,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url, failure_threshold=3, reset_timeout=60.0):
+    """Return the process-wide breaker for the host of `url`."""
+    host = urlsplit(url).netloc.lower()
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host, failure_threshold, reset_timeout)
+            _breakers[host] = breaker
+        return breaker
+
+
+def breaker_states():
+    """Snapshots of every breaker this process has created."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in breakers]
+
+
+# ─── Request loop ────────────────────────────────────────────────────────────
+
+class RetryReport:
+    """What happened across the attempts of one logical request."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.waited = 0.0
+        self.last_error = None
+        self.breaker_state = CircuitBreaker.CLOSED
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    def as_dict(self):
+        return {
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'waited': round(self.waited, 2),
+            'last_error': self.last_error,
+            'breaker_state': self.breaker_state,
+        }
+
+    def __str__(self):
+        return (f'attempts={self.attempts} waited={self.waited:.1f}s '
+                f'breaker={self.breaker_state}')
+
+
+def request_with_retry(method, url, policy=None, breaker=None, on_retry=None,
+                       sleep=time.sleep, clock=time.monotonic, **kwargs):
+    """
+    Issue `method url` with `kwargs` (passed to requests.request), retrying
+    network errors and retryable statuses per `policy`.
+    Returns (response, report). `response` is the last response received,
+    or None if every attempt ended in a network error.
+    Raises CircuitOpenError if the breaker refuses the request.
+    `on_retry(attempt, delay, error)` is called before each sleep.
+
+    The breaker counts requests, not attempts: one failure is recorded when
+    a request has used up its retries, so a single request's own retries
+    can't open it.
+    """
+    policy = policy or RetryPolicy()
+    breaker = breaker or get_breaker(url, policy.breaker_threshold, policy.breaker_reset)
+    report = RetryReport()
+    response = None
+    started = clock()
+
+    if not breaker.allow():
+        report.breaker_state = breaker.state
+        raise CircuitOpenError(breaker.host, breaker.retry_in())
+    # A half-open breaker lets one trial call through; it isn't retried.
+    attempts = 1 if breaker.state == CircuitBreaker.HALF_OPEN else policy.max_attempts
+
+    for attempt in range(1, attempts + 1):
+        if attempt > 1 and breaker.state == CircuitBreaker.OPEN:
+            break  # opened by other requests meanwhile
+        report.attempts = attempt
+        try:
+            response = requests.request(method, url, **kwargs)
+        except NETWORK_ERRORS as e:
+            response = None
+            report.last_error = f'network_error:{e}'
+            delay = policy.delay_for(attempt)
+        except Exception:
+            # Not retried, but the breaker must hear of it: a half-open
+            # trial that is never reported keeps the host locked out.
+            breaker.record_failure()
+            raise
+        else:
+            if not policy.is_retryable(method, response.status_code):
+                # A 5xx not worth retrying (e.g. 500 to a POST) still means
+                # the server is unwell.
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                report.breaker_state = breaker.state
+                return response, report
+            report.last_error = f'http_status_{response.status_code}'
+            delay = policy.delay_for(attempt, response)
+
+        if attempt == attempts:
+            break
+        if policy.budget is not None and clock() - started + delay > policy.budget:
+            report.last_error += ' (retry budget exhausted)'
+            break
+        if on_retry:
+            on_retry(attempt, delay, report.last_error)
+        sleep(delay)
+        report.waited += delay
+
+    # 429 means the server is alive and answering, just busy.
+    if response is not None and response.status_code == 429:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    report.breaker_state = breaker.state
+    return response, report
@@ -94,12 +94,32 @@ SECRET_KEY=${SECRET_KEY}
 ADMIN_USERNAME=${ADMIN_USERNAME}
 ADMIN_PASSWORD=${ADMIN_PASSWORD}
 FLASK_ENV=production
+# 建表与管理员由 flask init-db / create-admin 完成，worker 启动时不再执行
+AUTO_INIT_DB=0
+# 投稿文件存储：local（默认）或 s3（需 pip install boto3 并设置 S3_* 变量）
+STORAGE_BACKEND=local
+# 每个用户的存储配额（MB，0 为不限）；已取消/未通过投稿的文件保留天数
+USER_QUOTA_MB=0
+SWEEP_RETENTION_DAYS=30
+# 日志级别（JSON 日志写入 journald）
+LOG_LEVEL=INFO
+# 审核通过后同时上传到的 taiko-web 服务器（逗号分隔，留空则只用 taiko.asia）
+TAIKO_SERVER_URLS=
 EOF
 
 chmod 600 $APP_DIR/.env
 chown $APP_USER:$APP_USER $APP_DIR/.env
 echo -e "${GREEN}✓ 配置文件已生成: $APP_DIR/.env${NC}"
 
+# 初始化数据库与管理员账户（只在部署时执行一次）
+(cd $APP_DIR && set -a && . ./.env && set +a && \
+    $VENV_DIR/bin/flask --app app init-db && \
+    $VENV_DIR/bin/flask --app app migrate-storage && \
+    $VENV_DIR/bin/flask --app app usage-recount && \
+    $VENV_DIR/bin/flask --app app probe-audio && \
+    $VENV_DIR/bin/flask --app app create-admin --username "$ADMIN_USERNAME" --password "$ADMIN_PASSWORD")
+echo -e "${GREEN}✓ 数据库与管理员已初始化${NC}"
+
 # ── 6. 创建 systemd 服务（直接监听 80 端口） ─────────────────────────────
 echo -e "${CYAN}[5/5] 配置 systemd 服务...${NC}"
 
@@ -113,6 +133,11 @@ Type=notify
 User=root
 WorkingDirectory=${APP_DIR}
 EnvironmentFile=${APP_DIR}/.env
+# 每个 worker 的指标文件在重启时清空，/metrics 从零开始计数；reload（HUP）换下的 worker
+# 文件在抓取时并入 archive.json，计数继续累加
+ExecStartPre=/bin/rm -rf ${APP_DIR}/metrics
+# 表结构变更在重启时执行一次，而不是每个 worker 各做一遍
+ExecStartPre=${VENV_DIR}/bin/flask --app app init-db
 ExecStart=${VENV_DIR}/bin/gunicorn --workers 4 --bind 0.0.0.0:80 --timeout 120 app:app
 ExecReload=/bin/kill -HUP \$MAINPID
 Restart=always
@@ -122,6 +147,82 @@ RestartSec=5
 WantedBy=multi-user.target
 EOF
 
+# 每天清理已取消/未通过投稿的过期文件和孤立文件
+cat > /etc/systemd/system/${SERVICE_NAME}-sweep.service << EOF
+[Unit]
+Description=太鼓投稿网站存储清理
+
+[Service]
+Type=oneshot
+User=root
+WorkingDirectory=${APP_DIR}
+EnvironmentFile=${APP_DIR}/.env
+ExecStart=${VENV_DIR}/bin/flask --app app sweep
+EOF
+
+cat > /etc/systemd/system/${SERVICE_NAME}-sweep.timer << EOF
+[Unit]
+Description=每日运行太鼓投稿网站存储清理
+
+[Timer]
+OnCalendar=*-*-* 04:30:00
+RandomizedDelaySec=30min
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+EOF
+
+# 每 10 分钟按时间衰减重算「热门」排序分数
+cat > /etc/systemd/system/${SERVICE_NAME}-rank.service << EOF
+[Unit]
+Description=太鼓投稿网站热度重算
+
+[Service]
+Type=oneshot
+User=root
+WorkingDirectory=${APP_DIR}
+EnvironmentFile=${APP_DIR}/.env
+ExecStart=${VENV_DIR}/bin/flask --app app rank-decay
+EOF
+
+cat > /etc/systemd/system/${SERVICE_NAME}-rank.timer << EOF
+[Unit]
+Description=每 10 分钟重算太鼓投稿网站热度
+
+[Timer]
+OnBootSec=5min
+OnUnitActiveSec=10min
+
+[Install]
+WantedBy=timers.target
+EOF
+
+# 每小时重试上传失败的服务器（已成功的服务器不会重复上传）
+cat > /etc/systemd/system/${SERVICE_NAME}-redeliver.service << EOF
+[Unit]
+Description=太鼓投稿网站失败上传重试
+
+[Service]
+Type=oneshot
+User=root
+WorkingDirectory=${APP_DIR}
+EnvironmentFile=${APP_DIR}/.env
+ExecStart=${VENV_DIR}/bin/flask --app app redeliver
+EOF
+
+cat > /etc/systemd/system/${SERVICE_NAME}-redeliver.timer << EOF
+[Unit]
+Description=每小时重试太鼓投稿网站失败的上传
+
+[Timer]
+OnBootSec=15min
+OnUnitActiveSec=1h
+
+[Install]
+WantedBy=timers.target
+EOF
+
 # 确保 uploads 目录存在
 mkdir -p $APP_DIR/uploads
 chown -R $APP_USER:$APP_USER $APP_DIR
@@ -129,6 +230,9 @@ chown -R $APP_USER:$APP_USER $APP_DIR
 systemctl daemon-reload
 systemctl enable ${SERVICE_NAME}
 systemctl start ${SERVICE_NAME}
+systemctl enable --now ${SERVICE_NAME}-sweep.timer
+systemctl enable --now ${SERVICE_NAME}-rank.timer
+systemctl enable --now ${SERVICE_NAME}-redeliver.timer
 echo -e "${GREEN}✓ 服务已启动（监听 0.0.0.0:80）${NC}"
 
 # ── 完成 ─────────────────────────────────────────────────────────────────
@@ -0,0 +1,340 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from flask import send_file, send_from_directory
+from werkzeug.security import safe_join
+
+# ─── Submission file storage ─────────────────────────────────────────────────
+#
+# Files for a submission are addressed by (submission id, filename).
+#
+# LocalStorage keeps them under UPLOAD_FOLDER/objects/<ab>/<cd>/<id>/, where
+# ab/cd come from a hash of the id, so no directory grows past a few hundred
+# entries. Submissions from before sharding still live in UPLOAD_FOLDER/<id>/
+# and are read from there until `flask migrate-storage` moves them.
+#
+# S3Storage stores the same layout as object keys in an S3-compatible bucket
+# (AWS, MinIO, ...), so several app nodes can share it. It needs boto3.
+
+CHUNK_SIZE = 64 * 1024
+
+
+def shard(submission_id):
+    """Two-level hash prefix for a submission id, e.g. ('3f', 'a9')."""
+    h = hashlib.sha1(str(submission_id).encode('ascii')).hexdigest()
+    return h[:2], h[2:4]
+
+
+def _check_name(filename):
+    # Reject anything that could escape the submission's directory/prefix.
+    if not filename or safe_join('x', filename) is None or '/' in filename or '\\' in filename:
+        raise FileNotFoundError(filename)
+    return filename
+
+
+class LocalStorage:
+    """Hash-sharded directories on the local disk."""
+
+    def __init__(self, root):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+
+    def _dir(self, submission_id):
+        a, b = shard(submission_id)
+        return os.path.join(self.objects, a, b, str(submission_id))
+
+    def _legacy_dir(self, submission_id):
+        return os.path.join(self.root, str(submission_id))
+
+    def _find(self, submission_id, filename):
+        _check_name(filename)
+        for d in (self._dir(submission_id), self._legacy_dir(submission_id)):
+            p = os.path.join(d, filename)
+            if os.path.isfile(p):
+                return p
+        return None
+
+    def save(self, submission_id, filename, stream):
+        """Copy `stream` into storage; return the number of bytes written."""
+        d = self._dir(submission_id)
+        os.makedirs(d, exist_ok=True)
+        written = 0
+        with open(os.path.join(d, _check_name(filename)), 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def exists(self, submission_id, filename):
+        try:
+            return self._find(submission_id, filename) is not None
+        except FileNotFoundError:
+            return False
+
+    def size(self, submission_id, filename):
+        p = self._find(submission_id, filename)
+        if p is None:
+            raise FileNotFoundError(filename)
+        return os.path.getsize(p)
+
+    def open(self, submission_id, filename):
+        """Return a binary file object for reading."""
+        p = self._find(submission_id, filename)
+        if p is None:
+            raise FileNotFoundError(filename)
+        return open(p, 'rb')
+
+    @contextmanager
+    def local_path(self, submission_id, filename):
+        """Yield a filesystem path for the file (no copy for local storage)."""
+        p = self._find(submission_id, filename)
+        if p is None:
+            raise FileNotFoundError(filename)
+        yield p
+
+    def send(self, submission_id, filename, as_attachment=False, download_name=None):
+        """Flask response serving the file; raises FileNotFoundError."""
+        p = self._find(submission_id, filename)
+        if p is None:
+            raise FileNotFoundError(filename)
+        return send_from_directory(os.path.dirname(p), filename,
+                                   as_attachment=as_attachment, download_name=download_name)
+
+    def delete(self, submission_id):
+        """Remove every file of a submission; return the bytes freed."""
+        freed = 0
+        for d in (self._dir(submission_id), self._legacy_dir(submission_id)):
+            if os.path.isdir(d):
+                for entry in os.scandir(d):
+                    if entry.is_file():
+                        freed += entry.stat().st_size
+                shutil.rmtree(d, ignore_errors=True)
+        return freed
+
+    def list_ids(self):
+        """Yield the id of every submission that has files stored."""
+        for a in os.scandir(self.objects):
+            if not a.is_dir():
+                continue
+            for b in os.scandir(a.path):
+                if not b.is_dir():
+                    continue
+                for entry in os.scandir(b.path):
+                    if entry.is_dir() and entry.name.isdigit():
+                        yield int(entry.name)
+        yield from self.list_legacy_ids()
+
+    def list_legacy_ids(self):
+        """Ids still in the old flat UPLOAD_FOLDER/<id>/ layout."""
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name.isdigit():
+                yield int(entry.name)
+
+    def last_modified(self, submission_id):
+        """Newest mtime (epoch seconds) among the submission's files, or None."""
+        newest = None
+        for d in (self._dir(submission_id), self._legacy_dir(submission_id)):
+            if os.path.isdir(d):
+                for t in [os.stat(d).st_mtime] + [e.stat().st_mtime for e in os.scandir(d)]:
+                    newest = t if newest is None else max(newest, t)
+        return newest
+
+    def list_files(self, submission_id):
+        names = set()
+        for d in (self._dir(submission_id), self._legacy_dir(submission_id)):
+            if os.path.isdir(d):
+                names.update(e.name for e in os.scandir(d) if e.is_file())
+        return sorted(names)
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, keyed <prefix><ab>/<cd>/<id>/<name>."""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError('STORAGE_BACKEND=s3 需要安装 boto3（pip install boto3）')
+            client = boto3.client(
+                's3', endpoint_url=endpoint_url or None, region_name=region or None,
+                aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None,
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def _key(self, submission_id, filename=''):
+        a, b = shard(submission_id)
+        name = _check_name(filename) if filename else ''
+        return f'{self.prefix}{a}/{b}/{submission_id}/{name}'
+
+    def _missing(self, exc):
+        code = getattr(exc, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def _head(self, submission_id, filename):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(submission_id, filename))
+        except Exception as e:
+            if self._missing(e):
+                raise FileNotFoundError(filename)
+            raise
+
+    def save(self, submission_id, filename, stream):
+        counter = _CountingReader(stream)
+        ctype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        # upload_fileobj streams in multipart chunks, never the whole file.
+        self.client.upload_fileobj(counter, self.bucket, self._key(submission_id, filename),
+                                   ExtraArgs={'ContentType': ctype})
+        return counter.count
+
+    def exists(self, submission_id, filename):
+        try:
+            self._head(submission_id, filename)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def size(self, submission_id, filename):
+        return self._head(submission_id, filename)['ContentLength']
+
+    def _get(self, submission_id, filename):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(submission_id, filename))
+        except Exception as e:
+            if self._missing(e):
+                raise FileNotFoundError(filename)
+            raise
+
+    def open(self, submission_id, filename):
+        """Return the streaming body of the object."""
+        return self._get(submission_id, filename)['Body']
+
+    @contextmanager
+    def local_path(self, submission_id, filename):
+        """Download to a temporary file for callers that need a real path."""
+        body = self.open(submission_id, filename)
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(body, f, CHUNK_SIZE)
+            yield path
+        finally:
+            body.close()
+            os.unlink(path)
+
+    def send(self, submission_id, filename, as_attachment=False, download_name=None):
+        """Stream the object through the app in CHUNK_SIZE pieces."""
+        obj = self._get(submission_id, filename)
+        ctype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        resp = send_file(obj['Body'], mimetype=ctype, as_attachment=as_attachment,
+                         download_name=download_name or filename, conditional=False)
+        resp.content_length = obj['ContentLength']
+        return resp
+
+    def delete(self, submission_id):
+        freed = 0
+        keys = []
+        for obj in self._list(self._key(submission_id)):
+            freed += obj['Size']
+            keys.append({'Key': obj['Key']})
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys[i:i + 1000]})
+        return freed
+
+    def _list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from page.get('Contents', [])
+
+    def list_ids(self):
+        seen = set()
+        for obj in self._list(self.prefix):
+            parts = obj['Key'][len(self.prefix):].split('/')
+            if len(parts) == 4 and parts[2].isdigit():
+                sid = int(parts[2])
+                if sid not in seen:
+                    seen.add(sid)
+                    yield sid
+
+    def last_modified(self, submission_id):
+        times = [obj['LastModified'].timestamp() for obj in self._list(self._key(submission_id))]
+        return max(times) if times else None
+
+    def list_files(self, submission_id):
+        prefix = self._key(submission_id)
+        return sorted(obj['Key'][len(prefix):] for obj in self._list(prefix))
+
+
+class _CountingReader:
+    """File-like wrapper that counts the bytes read through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+def make_storage(config):
+    """Build the storage backend selected by STORAGE_BACKEND."""
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            access_key=config.get('S3_ACCESS_KEY'),
+            secret_key=config.get('S3_SECRET_KEY'),
+        )
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    raise ValueError(f'未知的 STORAGE_BACKEND: {backend}')
+
+
+def migrate_legacy(upload_folder, target, delete=True, log=print):
+    """
+    Move submissions from the flat UPLOAD_FOLDER/<id>/ layout into `target`.
+    Safe to re-run: ids already migrated are simply no longer in the flat
+    layout. Returns (submissions moved, bytes moved).
+    """
+    source = LocalStorage(upload_folder)
+    moved = moved_bytes = 0
+    for sid in sorted(source.list_legacy_ids()):
+        legacy = source._legacy_dir(sid)
+        names = [e.name for e in os.scandir(legacy) if e.is_file()]
+        if isinstance(target, LocalStorage) and \
+                os.path.realpath(target.root) == os.path.realpath(upload_folder):
+            dest = target._dir(sid)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.isdir(dest):
+                for name in names:
+                    os.replace(os.path.join(legacy, name), os.path.join(dest, name))
+                os.rmdir(legacy)
+            else:
+                os.rename(legacy, dest)  # same filesystem: O(1), no copy
+            moved_bytes += sum(os.path.getsize(os.path.join(dest, n)) for n in names)
+        else:
+            for name in names:
+                with open(os.path.join(legacy, name), 'rb') as f:
+                    moved_bytes += target.save(sid, name, f)
+            if delete:
+                shutil.rmtree(legacy)
+        moved += 1
+        if moved % 1000 == 0:
+            log(f'已迁移 {moved} 个投稿')
+    return moved, moved_bytes
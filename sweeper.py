@@ -0,0 +1,157 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Submission, UserUsage
+
+# ─── Per-user storage accounting & reclamation ───────────────────────────────
+#
+# user_usage holds the bytes each user has in storage. The upload view
+# charges it in the same transaction that creates the submission, with a
+# conditional UPDATE, so the quota check is a primary-key lookup and two
+# concurrent uploads cannot both slip under the limit.
+#
+# `flask sweep` (run daily by a systemd timer) deletes the files of
+# cancelled/rejected submissions once they have been closed for
+# SWEEP_RETENTION_DAYS, releasing their bytes, and removes stored files
+# whose submission row no longer exists.
+
+CLOSED_STATUSES = (Submission.STATUS_CANCELLED, Submission.STATUS_REJECTED)
+
+
+def backfill_closed_at():
+    """
+    Give submissions closed before closed_at existed a close time
+    (reviewed_at, else created_at) so sweep() can see them. No commit;
+    returns the number of rows updated.
+    """
+    result = db.session.execute(
+        update(Submission)
+        .where(Submission.status.in_(CLOSED_STATUSES), Submission.closed_at.is_(None))
+        .values(closed_at=func.coalesce(Submission.reviewed_at, Submission.created_at))
+        .execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def bytes_used(user_id):
+    row = db.session.get(UserUsage, user_id)
+    return row.bytes_used if row else 0
+
+
+def _ensure_row(user_id):
+    if db.session.get(UserUsage, user_id) is not None:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserUsage(user_id=user_id, bytes_used=0))
+    except IntegrityError:
+        pass  # created by a concurrent request
+
+
+def charge(user_id, nbytes, quota=0):
+    """
+    Add `nbytes` to the user's usage in the current transaction.
+    Returns False (and changes nothing) if that would exceed `quota`;
+    a quota of 0 means unlimited.
+    """
+    _ensure_row(user_id)
+    stmt = update(UserUsage).where(UserUsage.user_id == user_id)
+    if quota:
+        stmt = stmt.where(UserUsage.bytes_used + nbytes <= quota)
+    stmt = stmt.values(bytes_used=UserUsage.bytes_used + nbytes) \
+        .execution_options(synchronize_session=False)
+    return db.session.execute(stmt).rowcount == 1
+
+
+def release(user_id, nbytes):
+    stmt = update(UserUsage).where(UserUsage.user_id == user_id) \
+        .values(bytes_used=case((UserUsage.bytes_used > nbytes, UserUsage.bytes_used - nbytes),
+                                else_=0)) \
+        .execution_options(synchronize_session=False)
+    db.session.execute(stmt)
+
+
+def recount(storage, log=print):
+    """
+    Rebuild user_usage from Submission.storage_bytes. Submissions stored
+    before sizes were recorded are measured from storage first.
+    """
+    measured = 0
+    last_id = 0
+    while True:
+        batch = Submission.query.filter(Submission.id > last_id,
+                                        Submission.storage_bytes == 0,
+                                        Submission.purged_at.is_(None)) \
+            .order_by(Submission.id).limit(500).all()
+        if not batch:
+            break
+        for sub in batch:
+            size = 0
+            for name in (sub.tja_filename, sub.ogg_filename):
+                try:
+                    size += storage.size(sub.id, name)
+                except FileNotFoundError:
+                    pass
+            sub.storage_bytes = size
+            measured += 1
+        last_id = batch[-1].id
+        db.session.commit()
+        log(f'已统计 {measured} 个投稿的文件大小')
+
+    totals = db.session.query(Submission.user_id, func.sum(Submission.storage_bytes)) \
+        .filter(Submission.purged_at.is_(None)) \
+        .group_by(Submission.user_id).all()
+    UserUsage.query.delete()
+    db.session.add_all(UserUsage(user_id=uid, bytes_used=total or 0) for uid, total in totals)
+    db.session.commit()
+    return len(totals)
+
+
+def sweep(storage, retention_days, orphan_grace_hours=24, dry_run=False,
+          batch_size=200, log=print):
+    """
+    Reclaim storage. Returns counts and bytes for purged submissions and
+    orphaned files. With dry_run nothing is deleted.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=retention_days)
+    stats = {'purged': 0, 'purged_bytes': 0, 'orphans': 0, 'orphan_bytes': 0}
+
+    last_id = 0
+    while True:
+        batch = Submission.query.filter(Submission.status.in_(CLOSED_STATUSES),
+                                        Submission.purged_at.is_(None),
+                                        Submission.closed_at < cutoff,
+                                        Submission.id > last_id) \
+            .order_by(Submission.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for sub in batch:
+            stats['purged'] += 1
+            if dry_run:
+                stats['purged_bytes'] += sub.storage_bytes or 0
+                continue
+            stats['purged_bytes'] += storage.delete(sub.id)
+            release(sub.user_id, sub.storage_bytes or 0)
+            sub.purged_at = now
+        if not dry_run:
+            db.session.commit()
+        log(f'已清理 {stats["purged"]} 个已取消/未通过的投稿')
+
+    # Files without a submission row: failed uploads, rows deleted by hand.
+    # Skip recent ones, which may belong to an upload still in progress.
+    known = {sid for (sid,) in db.session.query(Submission.id)}
+    grace_start = time.time() - orphan_grace_hours * 3600
+    for sid in set(storage.list_ids()) - known:
+        modified = storage.last_modified(sid)
+        if modified is not None and modified > grace_start:
+            continue
+        stats['orphans'] += 1
+        if dry_run:
+            stats['orphan_bytes'] += sum(storage.size(sid, n) for n in storage.list_files(sid))
+        else:
+            stats['orphan_bytes'] += storage.delete(sid)
+    return stats
@@ -0,0 +1,70 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from bootstrap import init_db
+from models import db, Submission, User
+from storage import LocalStorage
+import sweeper
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 't.db')
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def _old_schema():
+    """A database from before closed_at existed."""
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_submissions_closed_at'))
+        conn.execute(text('ALTER TABLE submissions DROP COLUMN closed_at'))
+
+
+def test_closed_before_upgrade_is_backfilled_and_swept(app, tmp_path):
+    _old_schema()
+    long_ago = datetime.utcnow() - timedelta(days=90)
+    recently = datetime.utcnow() - timedelta(days=2)
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, username, email, password_hash, is_admin) "
+                          "VALUES (1, 'u', 'u@x', 'x', 0)"))
+        for sid, status, created, reviewed in (
+                (1, 'rejected', long_ago, long_ago),   # closed by review
+                (2, 'cancelled', long_ago, None),      # cancelled: no reviewed_at
+                (3, 'rejected', long_ago, recently),   # inside the retention window
+                (4, 'approved', long_ago, long_ago)):  # not closed
+            conn.execute(text(
+                'INSERT INTO submissions (id, user_id, title, tja_filename, ogg_filename, '
+                'status, created_at, reviewed_at, storage_bytes) '
+                "VALUES (:id, 1, 't', 'a.tja', 'a.ogg', :status, :created, :reviewed, 3)"),
+                {'id': sid, 'status': status, 'created': created, 'reviewed': reviewed})
+
+    init_db()
+
+    closed_at = {s.id: s.closed_at for s in Submission.query}
+    assert closed_at[1] == long_ago
+    assert closed_at[2] == long_ago
+    assert closed_at[3] == recently
+    assert closed_at[4] is None
+
+    storage = LocalStorage(str(tmp_path / 'up'))
+    for sid in (1, 2, 3, 4):
+        storage.save(sid, 'a.tja', io.BytesIO(b'abc'))
+    stats = sweeper.sweep(storage, retention_days=30, log=lambda msg: None)
+
+    assert stats['purged'] == 2
+    assert sorted(storage.list_ids()) == [3, 4]
+    assert db.session.get(User, 1) is not None
+
+
+def test_backfill_is_idempotent(app):
+    init_db()
+    assert sweeper.backfill_closed_at() == 0
@@ -1,8 +1,8 @@
-import os
 import re
-import requests
 from urllib.parse import urljoin
 
+from retry_policy import CircuitOpenError, request_with_retry
+
 # ─── Sensitive word filter ───────────────────────────────────────────────────
 
 SENSITIVE_WORDS = [
@@ -45,10 +45,34 @@ def filter_sensitive_words(text):
 
 # ─── Upload to taiko.asia ────────────────────────────────────────────────────
 
-def upload_to_taiko_server(tja_path, ogg_path, song_type, server_url, use_proxy=False, proxy_url=None):
+def read_chart(tja_path, ogg_path):
+    """Load TJA + OGG into the multipart `files` mapping that post_chart() sends."""
+    with open(tja_path, 'rb') as ft, open(ogg_path, 'rb') as fm:
+        return {
+            'file_tja': ('main.tja', ft.read(), 'text/plain'),
+            'file_music': ('music.ogg', fm.read(), 'audio/ogg'),
+        }
+
+
+def upload_to_taiko_server(tja_path, ogg_path, song_type, server_url, use_proxy=False, proxy_url=None,
+                           policy=None, on_retry=None):
+    """
+    Upload TJA + OGG to a taiko-web server, retrying per `policy`
+    (see retry_policy). Returns (success: bool, message: str).
+    """
+    try:
+        # Read once; retries resend the same bytes instead of re-reading disk.
+        files = read_chart(tja_path, ogg_path)
+    except Exception as e:
+        return False, f'上传异常: {e}'
+    return post_chart(files, song_type, server_url, use_proxy, proxy_url, policy, on_retry)
+
+
+def post_chart(files, song_type, server_url, use_proxy=False, proxy_url=None,
+               policy=None, on_retry=None):
     """
-    Upload TJA + OGG to a taiko-web server.
-    Returns (success: bool, message: str).
+    Send an already-read chart (see read_chart) to one server. `files` is
+    only read, so several threads can post the same chart to different servers.
     """
     base = server_url.strip()
     if not base.lower().startswith(('http://', 'https://')):
@@ -64,54 +88,41 @@ def upload_to_taiko_server(tja_path, ogg_path, song_type, server_url, use_proxy=
             'https': proxy_url,
         }
 
-    max_attempts = 3
-    wait_seconds = 10
-
-    for attempt in range(1, max_attempts + 1):
-        try:
-            with open(tja_path, 'rb') as ft, open(ogg_path, 'rb') as fm:
-                files = {
-                    'file_tja': ('main.tja', ft.read(), 'text/plain'),
-                    'file_music': ('music.ogg', fm.read(), 'audio/ogg'),
-                }
-                data = {'song_type': song_type}
-                resp = requests.post(url, files=files, data=data, timeout=60, proxies=proxies)
-
-            if resp.status_code != 200:
-                return False, f'HTTP {resp.status_code}'
-            try:
-                j = resp.json()
-            except Exception:
-                return False, '服务器响应非 JSON'
-            if j.get('success') is True:
-                return True, 'ok'
-            return False, j.get('error') or '未知错误'
-
-        except (requests.exceptions.ProxyError,
-                requests.exceptions.ConnectTimeout,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout):
-            if attempt < max_attempts:
-                import time
-                time.sleep(wait_seconds)
-                continue
-            else:
-                return False, '网络连接失败，请稍后重试'
-        except Exception as e:
-            return False, f'上传异常: {e}'
-
-    return False, '上传失败'
+    try:
+        resp, report = request_with_retry(
+            'POST', url, policy=policy, on_retry=on_retry,
+            files=files, data={'song_type': song_type}, timeout=60, proxies=proxies,
+        )
+    except CircuitOpenError as e:
+        return False, f'服务器暂不可用（{e}）'
+    except Exception as e:
+        return False, f'上传异常: {e}'
+
+    if resp is None:
+        return False, f'网络连接失败，请稍后重试（{report}）'
+    if resp.status_code != 200:
+        if report.retries:
+            return False, f'HTTP {resp.status_code}（{report}）'
+        return False, f'HTTP {resp.status_code}'
+    try:
+        j = resp.json()
+    except Exception:
+        return False, '服务器响应非 JSON'
+    if j.get('success') is True:
+        return True, 'ok'
+    return False, j.get('error') or '未知错误'
 
 
 # ─── File helpers ─────────────────────────────────────────────────────────────
 
+def format_duration(seconds):
+    """'3:05' for 185.2 seconds; '' when unknown (not probed yet)."""
+    if seconds is None:
+        return ''
+    m, s = divmod(int(round(seconds)), 60)
+    return f'{m}:{s:02d}'
+
+
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
-
-def ensure_upload_dir(upload_folder, submission_id):
-    """Create per-submission upload directory, return the path."""
-    path = os.path.join(upload_folder, str(submission_id))
-    os.makedirs(path, exist_ok=True)
-    return path
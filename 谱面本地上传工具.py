@@ -3,13 +3,32 @@ import sys
 import json
 import shutil
 import pathlib
-import requests
-import time
 import argparse
+import logging
+import time
 from urllib.parse import urljoin
 from typing import Dict
 import re
 
+from retry_policy import CircuitOpenError, RetryPolicy, breaker_states, request_with_retry
+import jsonlog
+
+# Progress goes through a background writer (jsonlog), so a slow terminal or
+# pipe never stalls the upload loop. --log-json FILE also writes every event
+# as a JSON line: {"event": "uploaded", "song": "01 Pop/xxx", "duration_ms": ...}
+log = logging.getLogger('taiko.uploader')
+
+def _setup_logging(json_path=None):
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    handlers = [console]
+    if json_path:
+        f = logging.FileHandler(json_path, encoding='utf-8')
+        f.setFormatter(jsonlog.JsonFormatter())
+        handlers.append(f)
+    log.propagate = False
+    jsonlog.start(handlers, logger=log)
+
 def _get_basedir():
     try:
         root = pathlib.Path(__file__).resolve().parent
@@ -41,43 +60,41 @@ def _find_first_with_ext(dir_path, ext):
             return p
     return None
 
-def _upload_song(url, song_type, tja_path, music_path, use_proxy):
-    # Retry on connection/proxy/timeout related errors.
-    max_attempts = 3
-    wait_seconds = 10
-    for attempt in range(1, max_attempts + 1):
-        try:
-            with open(tja_path, 'rb') as ft, open(music_path, 'rb') as fm:
-                files = {
-                    'file_tja': ('main.tja', ft.read(), 'text/plain'),
-                    'file_music': ('music.ogg', fm.read(), 'audio/ogg'),
-                }
-                data = {'song_type': song_type}
-                proxies = _get_proxies() if use_proxy else None
-                resp = requests.post(url, files=files, data=data, timeout=60, proxies=proxies)
-            if resp.status_code != 200:
-                return False, f'http_status_{resp.status_code}'
-            try:
-                j = resp.json()
-            except Exception:
-                return False, 'invalid_json'
-            if j.get('success') is True:
-                return True, 'ok'
-            return False, j.get('error') or 'unknown_error'
-        except (requests.exceptions.ProxyError,
-                requests.exceptions.ConnectTimeout,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout) as e:
-            # Only retry for these network/proxy/timeout errors
-            if attempt < max_attempts:
-                print(f'网络错误（{e}），{attempt}/{max_attempts}。等待 {wait_seconds} 秒后重试...')
-                time.sleep(wait_seconds)
-                continue
-            else:
-                return False, f'network_error:{e}'
-        except Exception as e:
-            # Non-network related error — don't retry
-            return False, f'error:{e}'
+def _upload_song(url, song_type, tja_path, music_path, use_proxy, policy=None, song=None):
+    # Backoff, Retry-After and the per-host breaker live in retry_policy.
+    def _on_retry(attempt, delay, error):
+        log.warning(f'上传出错（{error}），{attempt}/{policy.max_attempts}。等待 {delay:.1f} 秒后重试...',
+                    extra={'event': 'retry', 'song': song, 'attempt': attempt,
+                           'delay_s': round(delay, 2), 'error': str(error)})
+
+    policy = policy or RetryPolicy()
+    try:
+        with open(tja_path, 'rb') as ft, open(music_path, 'rb') as fm:
+            files = {
+                'file_tja': ('main.tja', ft.read(), 'text/plain'),
+                'file_music': ('music.ogg', fm.read(), 'audio/ogg'),
+            }
+        data = {'song_type': song_type}
+        proxies = _get_proxies() if use_proxy else None
+        resp, report = request_with_retry('POST', url, policy=policy, on_retry=_on_retry,
+                                          files=files, data=data, timeout=60, proxies=proxies)
+    except CircuitOpenError as e:
+        # Fail fast: songs not in uploaded.json are retried on the next run.
+        return False, f'circuit_open:{e}'
+    except Exception as e:
+        # Non-network related error — don't retry
+        return False, f'error:{e}'
+    if resp is None:
+        return False, f'{report.last_error} ({report})'
+    if resp.status_code != 200:
+        return False, f'http_status_{resp.status_code}'
+    try:
+        j = resp.json()
+    except Exception:
+        return False, 'invalid_json'
+    if j.get('success') is True:
+        return True, 'ok'
+    return False, j.get('error') or 'unknown_error'
 
 def _get_proxies() -> Dict[str, str]:
     return {
@@ -123,7 +140,9 @@ def main():
     parser.add_argument('site_url', nargs='?', help='站点URL')
     parser.add_argument('proxy', nargs='?', help='是否使用代理(y/n)')
     parser.add_argument('mode', nargs='?', help='模式 (1: 上传, 2: 扫描缺失)')
+    parser.add_argument('--log-json', metavar='FILE', help='另将进度按行写成 JSON')
     args = parser.parse_args()
+    _setup_logging(args.log_json)
 
     if not args.ese_path:
         try:
@@ -164,21 +183,22 @@ def main():
     is_scan_mode = (mode_input == '2')
 
     if is_scan_mode:
-        print("正在获取服务器歌曲列表...")
+        log.info("正在获取服务器歌曲列表...", extra={'event': 'scan_start'})
         server_songs = _fetch_server_songs(url_input, proxies)
         if server_songs is None:
-             print("无法获取服务器列表，扫描终止。")
+             log.error("无法获取服务器列表，扫描终止。", extra={'event': 'scan_failed'})
              return
-        print(f"服务器现有歌曲: {len(server_songs)} 首")
+        log.info(f"服务器现有歌曲: {len(server_songs)} 首", extra={'event': 'server_songs', 'count': len(server_songs)})
 
     url = _build_upload_url(url_input)
+    policy = RetryPolicy()
     uploaded_path = _uploaded_file_path()
     uploaded_set = _load_uploaded_set(uploaded_path)
     
     try:
         ese_dir = pathlib.Path(ese_input) if ese_input else pathlib.Path(__file__).resolve().parent / 'ESE'
         if not ese_dir.exists() or not ese_dir.is_dir():
-            print('ESE目录不存在')
+            log.error('ESE目录不存在', extra={'event': 'no_ese_dir', 'path': str(ese_dir)})
             return
         
         KNOWN_TYPES = {
@@ -199,10 +219,11 @@ def main():
         
         type_dirs = [d for d in ese_dir.iterdir() if d.is_dir() and not d.name.startswith('.') and _valid_type(d.name)]
         if not type_dirs:
-            print('ESE目录下没有合法的歌曲类型目录')
+            log.error('ESE目录下没有合法的歌曲类型目录', extra={'event': 'no_type_dirs', 'path': str(ese_dir)})
             return
             
         missing_count = 0
+        counts = {'uploaded': 0, 'failed': 0, 'skipped': 0}
         for type_dir in type_dirs:
             song_type = type_dir.name
             song_dirs = [d for d in type_dir.iterdir() if d.is_dir()]
@@ -213,33 +234,51 @@ def main():
                 
                 if is_scan_mode:
                     if key not in server_songs:
-                        print(f"[缺失] {key}")
+                        log.info(f"[缺失] {key}", extra={'event': 'missing', 'song': key})
                         missing_count += 1
                     continue
 
                 if key in uploaded_set:
-                    print(f'已上传跳过：{key}')
+                    counts['skipped'] += 1
+                    log.info(f'已上传跳过：{key}', extra={'event': 'skipped', 'song': key, 'reason': 'uploaded'})
                     continue
                 
                 tja_path = _find_first_with_ext(str(song_dir), '.tja')
                 if tja_path is None:
-                    print(f'跳过：{key}，未找到TJA')
+                    counts['skipped'] += 1
+                    log.warning(f'跳过：{key}，未找到TJA', extra={'event': 'skipped', 'song': key, 'reason': 'no_tja'})
                     continue
                     
                 music_path = _find_first_with_ext(str(song_dir), '.ogg')
                 if music_path is None:
-                    print(f'跳过：{key}，未找到OGG')
+                    counts['skipped'] += 1
+                    log.warning(f'跳过：{key}，未找到OGG', extra={'event': 'skipped', 'song': key, 'reason': 'no_ogg'})
                     continue
                     
-                ok, msg = _upload_song(url, song_type, tja_path, music_path, use_proxy)
+                started = time.perf_counter()
+                ok, msg = _upload_song(url, song_type, tja_path, music_path, use_proxy, policy, song=key)
+                fields = {'song': key, 'song_type': song_type,
+                          'bytes': os.path.getsize(tja_path) + os.path.getsize(music_path),
+                          'duration_ms': round((time.perf_counter() - started) * 1000, 1)}
                 if ok:
                     uploaded_set.add(key)
-                    print(f'上传完成：{key}')
+                    counts['uploaded'] += 1
+                    log.info(f'上传完成：{key}', extra=dict(fields, event='uploaded'))
                 else:
-                    print(f'上传失败跳过：{key}，原因：{msg}')
+                    counts['failed'] += 1
+                    log.error(f'上传失败跳过：{key}，原因：{msg}', extra=dict(fields, event='failed', error=msg))
         
         if is_scan_mode:
-            print(f"扫描完成，共发现 {missing_count} 首缺失歌曲。")
+            log.info(f"扫描完成，共发现 {missing_count} 首缺失歌曲。", extra={'event': 'scan_done', 'missing': missing_count})
+        else:
+            for b in breaker_states():
+                log.info(f"服务器 {b['host']}: 熔断器 {b['state']}，成功 {b['total_successes']} 次，"
+                         f"失败 {b['total_failures']} 次，快速失败 {b['rejected']} 次",
+                         extra={'event': 'breaker', 'host': b['host'], 'state': b['state'],
+                                'successes': b['total_successes'], 'failures': b['total_failures'],
+                                'rejected': b['rejected']})
+            log.info(f"上传结束：成功 {counts['uploaded']} 首，失败 {counts['failed']} 首，跳过 {counts['skipped']} 首",
+                     extra=dict(counts, event='done'))
 
     finally:
         if not is_scan_mode:
@@ -258,9 +297,12 @@ def _fetch_server_songs(base_url, proxies):
         api_url = urljoin(base, 'api/songs')
     
     try:
-        resp = requests.get(api_url, proxies=proxies, timeout=30)
+        resp, _ = request_with_retry('GET', api_url, proxies=proxies, timeout=30)
+        if resp is None:
+            log.error("获取服务器列表失败: 网络错误", extra={'event': 'songs_failed'})
+            return None
         if resp.status_code != 200:
-             print(f"获取服务器列表失败: HTTP {resp.status_code}")
+             log.error(f"获取服务器列表失败: HTTP {resp.status_code}", extra={'event': 'songs_failed', 'status': resp.status_code})
              return None
         data = resp.json()
         
@@ -280,7 +322,7 @@ def _fetch_server_songs(base_url, proxies):
                  server_set.add(f"{cat}/{title}")
         return server_set
     except Exception as e:
-        print(f"获取服务器列表出错: {e}")
+        log.error(f"获取服务器列表出错: {e}", extra={'event': 'songs_failed', 'error': str(e)})
         return None
 
 if __name__ == '__main__':
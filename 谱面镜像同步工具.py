@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import pathlib
+import argparse
+import tarfile
+from urllib.parse import urljoin
+
+import requests
+import urllib3
+
+from retry_policy import CircuitOpenError, RetryPolicy, request_with_retry
+
+# 从投稿站点增量拉取已通过的谱面，按 ESE 目录结构（分类/曲名/）写入本地，
+# 之后可直接用「谱面本地上传工具.py」上传到镜像服务器。
+# 服务器每次最多返回一页谱面，每页结束记录返回的 until，直到没有更多；
+# 下次只拉取之后通过的谱面。
+
+CHUNK_SIZE = 64 * 1024
+
+def _state_file_path():
+    return pathlib.Path(__file__).resolve().parent / 'mirror_state.json'
+
+def _load_state(p: pathlib.Path):
+    try:
+        with open(p, 'r', encoding='utf-8') as f:
+            j = json.load(f)
+        if isinstance(j, dict):
+            return j
+    except Exception:
+        pass
+    return {}
+
+def _save_state(p: pathlib.Path, state):
+    tmp = p.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, p)
+
+def _build_export_url(base_url):
+    base = base_url.strip()
+    if not base.lower().startswith(('http://', 'https://')):
+        base = 'http://' + base
+    if not base.endswith('/'):
+        base += '/'
+    return urljoin(base, 'export.tar')
+
+def _safe_target(ese_dir: pathlib.Path, name: str):
+    # Never write outside the ESE directory, whatever the archive says.
+    target = (ese_dir / name).resolve()
+    if ese_dir.resolve() not in target.parents:
+        return None
+    return target
+
+def _extract_stream(resp, ese_dir: pathlib.Path, log=print):
+    """Unpack a streamed tar export into ese_dir; return the manifest dict."""
+    manifest = None
+    songs = set()
+    with tarfile.open(fileobj=resp.raw, mode='r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            src = tar.extractfile(member)
+            if member.name == 'manifest.json':
+                manifest = json.loads(src.read().decode('utf-8'))
+                continue
+            target = _safe_target(ese_dir, member.name)
+            if target is None:
+                log(f'跳过不安全的路径：{member.name}')
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            part = target.with_name(target.name + '.part')
+            with open(part, 'wb') as f:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            os.replace(part, target)
+            song = str(pathlib.PurePosixPath(member.name).parent)
+            if song not in songs:
+                songs.add(song)
+                log(f'已同步：{song}')
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='从投稿站点增量同步已通过的谱面到 ESE 目录')
+    parser.add_argument('site_url', nargs='?', help='投稿站点URL')
+    parser.add_argument('ese_path', nargs='?', help='ESE目录路径')
+    parser.add_argument('--full', action='store_true', help='忽略上次同步记录，全量拉取')
+    parser.add_argument('--token', default=os.environ.get('EXPORT_TOKEN'),
+                        help='站点设置了 EXPORT_TOKEN 时需要（也可用同名环境变量）')
+    args = parser.parse_args()
+
+    site_url = args.site_url
+    if not site_url:
+        try:
+            site_url = input('请输入投稿站点URL: ').strip()
+        except EOFError:
+            site_url = ''
+    if not site_url:
+        print('未指定投稿站点')
+        return 1
+
+    ese_input = args.ese_path
+    if not ese_input:
+        try:
+            ese_input = input('请输入ESE目录路径: ').strip()
+        except EOFError:
+            ese_input = ''
+    ese_dir = pathlib.Path(ese_input) if ese_input else pathlib.Path(__file__).resolve().parent / 'ESE'
+    ese_dir.mkdir(parents=True, exist_ok=True)
+
+    url = _build_export_url(site_url)
+    state_path = _state_file_path()
+    state = _load_state(state_path)
+    since = None if args.full else state.get(url)
+    print(f'增量同步：{since} 之后通过的谱面' if since else '全量同步')
+
+    # The server sends at most EXPORT_PAGE_SIZE songs per archive; keep
+    # asking from the returned until while it says there is more.
+    policy = RetryPolicy()
+    total = 0
+    while True:
+        params = {'since': since} if since else {}
+        if args.token:
+            params['token'] = args.token
+        try:
+            resp, report = request_with_retry('GET', url, policy=policy, params=params or None,
+                                              stream=True, timeout=60)
+        except CircuitOpenError as e:
+            print(f'服务器暂时不可用：{e}')
+            return 1
+        if resp is None:
+            print(f'下载失败：{report.last_error}')
+            return 1
+        if resp.status_code != 200:
+            print(f'下载失败：HTTP {resp.status_code}')
+            resp.close()
+            return 1
+
+        try:
+            manifest = _extract_stream(resp, ese_dir)
+        except (tarfile.TarError, OSError, requests.RequestException,
+                urllib3.exceptions.HTTPError) as e:
+            # Connection dropped or archive cut short. Files already written
+            # are complete; the next run repeats this page.
+            print(f'同步中断：{e}')
+            return 1
+        finally:
+            resp.close()
+        if manifest is None:
+            print('同步中断：未收到 manifest.json')
+            return 1
+
+        since = manifest['until']
+        state[url] = since
+        _save_state(state_path, state)
+        total += manifest['count']
+        if manifest.get('missing'):
+            print(f"服务器缺少文件的投稿：{manifest['missing']}")
+        if not manifest.get('more'):
+            break
+        print(f"已同步 {total} 首，继续拉取 {since} 之后的谱面")
+
+    print(f"同步完成：{total} 首，截至 {since}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())